@@ -0,0 +1,115 @@
+"""Worker ishga tushishi va birinchi so'rovlar kechikishini o'lchash.
+
+Uch rejimda bitta gunicorn worker'ni ishga tushiradi:
+  no-cache          - bytecode keshsiz, isitishsiz (eski holat)
+  bytecode          - `flask compile-templates` bilan tayyorlangan kesh, isitishsiz
+  bytecode+warm-up  - kesh + post_worker_init dagi warm_up()
+Har bir rejim uchun worker tayyor bo'lguncha vaqt va har bir sahifaning
+birinchi so'rov kechikishi (bir necha urinish medianasi) chiqariladi.
+
+    python bench/worker_startup.py --rounds 5
+"""
+import argparse
+import http.client
+import os
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['/', '/materials', '/material/1', '/search?q=Material', '/login', '/register']
+MODES = [
+    ('no-cache', {'TEMPLATE_CACHE_DIR': '', 'WARM_UP': '0'}),
+    ('bytecode', {'WARM_UP': '0'}),
+    ('bytecode+warm-up', {'WARM_UP': '1'}),
+]
+
+
+def get(port, path, timeout=30):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def wait_ready(port, timeout=30):
+    """Statik fayl (shablonsiz) javob berguncha kutish"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            get(port, '/static/css/style.css', timeout=timeout)
+            return
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError('gunicorn did not start')
+
+
+def seed(env):
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=APP_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    db = sqlite3.connect(env['DB_PATH'])
+    db.executemany(
+        "INSERT INTO materials (title, author, description, material_type, created_at, uploaded_by) VALUES (?,?,?,?,?,1)",
+        [(f"Material {i}", "Bench", "Synthetic", "book", "2026-01-01T00:00:00") for i in range(50)]
+    )
+    db.commit()
+    db.close()
+
+
+def run_once(port, env):
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', '1',
+         '--log-level', 'warning'],
+        cwd=APP_DIR, env=env,
+    )
+    try:
+        wait_ready(port)
+        ready = time.perf_counter() - started
+        first = {}
+        for path in PAGES:
+            t = time.perf_counter()
+            get(port, path)
+            first[path] = time.perf_counter() - t
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait()
+    return ready, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8797)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    base_env = dict(os.environ, DB_PATH=os.path.join(tmp, 'data.db'), UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                    TEMPLATE_CACHE_DIR=os.path.join(tmp, 'jinja_cache'), HASH_WORKERS='0')
+    seed(base_env)
+    t = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'compile-templates'], cwd=APP_DIR,
+                   env=base_env, check=True, stdout=subprocess.DEVNULL)
+    print(f"compile-templates: {(time.perf_counter() - t) * 1000:.0f} ms (including interpreter start)\n")
+
+    header = f"{'mode':<18} {'ready ms':>9} {'first-req total ms':>19}  " + ' '.join(f"{p[:12]:>12}" for p in PAGES)
+    print(header)
+    for name, overrides in MODES:
+        env = dict(base_env, **overrides)
+        results = [run_once(args.port, env) for _ in range(args.rounds)]
+        ready = statistics.median(r[0] for r in results) * 1000
+        per_page = {p: statistics.median(r[1][p] for r in results) * 1000 for p in PAGES}
+        print(f"{name:<18} {ready:>9.0f} {sum(per_page.values()):>19.1f}  "
+              + ' '.join(f"{per_page[p]:>12.1f}" for p in PAGES))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Gunicorn sozlamalari (gunicorn ishchi papkadan avtomatik o'qiydi).
+
+SERVE_MODE=sync   - standart: har bir worker bir vaqtda bitta so'rovga xizmat qiladi.
+SERVE_MODE=gevent - asinxron rejim: yuklash/yuklab olish kabi uzoq I/O so'rovlari
+                    greenlet'larda bajariladi, bitta jarayon yuzlab sekin mijozlarni
+                    bir vaqtda ko'taradi. Flask marshrutlari o'zgarmaydi.
+"""
+import os
+import shutil
+
+SERVE_MODE = os.environ.get('SERVE_MODE', 'sync')
+
+if SERVE_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+    # Uzoq yuklashlar ham heartbeat yuboradi, shuning uchun timeout oddiy qoladi
+    keepalive = 5
+
+
+def on_starting(server):
+    """Yangi ishga tushirishda oldingi jarayonlar metrikalarini tozalash (PID'lar qayta ishlatiladi)"""
+    metrics_dir = os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.metrics'))
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    """Worker so'rov qabul qilishdan oldin shablonlar va asosiy sahifalarni isitish"""
+    if os.environ.get('WARM_UP', '1') == '0':
+        return
+    import app
+    count, seconds = app.warm_up()
+    worker.log.info(f"Worker {worker.pid} warmed up: {count} templates in {seconds * 1000:.0f}ms")
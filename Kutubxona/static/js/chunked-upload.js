@@ -0,0 +1,122 @@
+// Katta fayllarni bo'laklab yuklash: aloqa uzilsa, server saqlagan joydan davom etadi.
+// Forma: <form data-chunked-upload data-upload-url="..." [data-material-id="..."]>
+(function () {
+  const RETRIES = 8;
+
+  function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  async function json(response) {
+    const data = await response.json().catch(function () { return {}; });
+    // "upload busy" - oldingi so'rov hali yozmoqda: kutib, qayta urinamiz
+    if (!response.ok && (response.status !== 409 || data.error === 'upload busy')) {
+      throw new Error(data.error || ('HTTP ' + response.status));
+    }
+    return data;
+  }
+
+  async function openSession(form, file, storageKey) {
+    const saved = localStorage.getItem(storageKey);
+    if (saved) {
+      const status = await fetch(form.dataset.uploadUrl + '/' + saved, { credentials: 'same-origin' });
+      if (status.ok) {
+        return await status.json();
+      }
+      localStorage.removeItem(storageKey);
+    }
+    const typeSelect = form.querySelector('[name=material_type]');
+    const session = await json(await fetch(form.dataset.uploadUrl, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        material_type: typeSelect ? typeSelect.value : undefined,
+        material_id: form.dataset.materialId || undefined
+      })
+    }));
+    localStorage.setItem(storageKey, session.upload_id);
+    return session;
+  }
+
+  async function sendChunks(form, file, session, progress) {
+    const url = form.dataset.uploadUrl + '/' + session.upload_id;
+    const chunkSize = session.chunk_size;
+    let offset = session.offset;
+    let failures = 0;
+    while (offset < file.size) {
+      progress(offset);
+      try {
+        const response = await fetch(url, {
+          method: 'PUT',
+          credentials: 'same-origin',
+          headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream' },
+          body: file.slice(offset, offset + chunkSize)
+        });
+        offset = (await json(response)).offset;
+        failures = 0;
+      } catch (err) {
+        // Aloqa uzildi - kutib, serverdan joriy offsetni so'raymiz
+        if (++failures > RETRIES) {
+          throw err;
+        }
+        await sleep(Math.min(30000, 1000 * Math.pow(2, failures)));
+        const status = await fetch(url, { credentials: 'same-origin' }).catch(function () { return null; });
+        if (status && status.ok) {
+          offset = (await status.json()).offset;
+        }
+      }
+    }
+    progress(offset);
+    return url;
+  }
+
+  function upload(form, file) {
+    const storageKey = 'upload:' + form.dataset.uploadUrl + ':' + (form.dataset.materialId || '') +
+      ':' + file.name + ':' + file.size + ':' + file.lastModified;
+    const button = form.querySelector('[type=submit]');
+    const status = document.createElement('div');
+    status.className = 'upload-progress';
+    form.appendChild(status);
+    button.disabled = true;
+
+    function progress(offset) {
+      status.textContent = '⬆️ ' + Math.floor(offset * 100 / Math.max(file.size, 1)) + '%';
+    }
+
+    return openSession(form, file, storageKey)
+      .then(function (session) { return sendChunks(form, file, session, progress); })
+      .then(async function (url) {
+        const fields = new FormData(form);
+        fields.delete('file');
+        const result = await json(await fetch(url + '/commit', {
+          method: 'POST',
+          credentials: 'same-origin',
+          body: new URLSearchParams(fields)
+        }));
+        if (!result.redirect) {
+          throw new Error(result.error || 'commit failed');
+        }
+        localStorage.removeItem(storageKey);
+        window.location = result.redirect;
+      })
+      .catch(function (err) {
+        status.textContent = '❌ ' + err.message + ' — дубора кӯшиш кунед, боргузорӣ аз ҳамон ҷо идома меёбад.';
+        button.disabled = false;
+      });
+  }
+
+  document.querySelectorAll('form[data-chunked-upload]').forEach(function (form) {
+    form.addEventListener('submit', function (e) {
+      const input = form.querySelector('input[type=file]');
+      const file = input && input.files[0];
+      if (!file || !window.fetch) {
+        return;  // oddiy multipart forma
+      }
+      e.preventDefault();
+      upload(form, file);
+    });
+  });
+})();
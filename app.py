@@ -1,24 +1,94 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, abort, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, jsonify, g, has_app_context, has_request_context, make_response, Response
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
+import click
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from urllib.parse import quote as url_quote
 import sqlite3
 import os
 import datetime
+import queue
+import concurrent.futures
+import multiprocessing
+import fcntl
+import mimetypes
+import threading
+import time
+import atexit
+import logging
+import json
+import hashlib
+import signal
+import socket
+import collections
+import zlib
+import heapq
+import csv
+import shutil
+import bisect
+import hmac
+import secrets
+import tempfile
+import contextlib
+import io
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow o'rnatilmagan - thumbnail'lar o'chiq, asl rasm ko'rsatiladi
+    Image = ImageOps = features = None
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 faqat STORAGE_BACKEND=s3 uchun kerak
+    boto3 = None
+    ClientError = Exception
 
 # ========================
 # KONFIGURATSIYA
 # ========================
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-DB_PATH = os.path.join(BASE_DIR, 'data.db')
+DB_PATH = os.environ.get('DB_PATH', os.path.join(BASE_DIR, 'data.db'))
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.secret_key = "CHANGE_THIS_TO_RANDOM_SECRET_KEY_IN_PRODUCTION_123456789"
 
+# Yuklab olishni front proxy'ga topshirish: '' (o'zimiz), 'accel' (nginx X-Accel-Redirect)
+# yoki 'sendfile' (Apache/lighttpd X-Sendfile)
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '')
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/_protected_uploads/')
+
+# Bo'laklab yuklash: bo'lak hajmi MAX_CONTENT_LENGTH dan kichik bo'lishi kerak
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))  # soniya
+
+# Statistika sahifasidagi grafiklar oralig'i
+STATS_DAYS = 30
+STATS_HOURS = 48
+
+# Jinja bytecode keshi: shablonlar bir marta kompilyatsiya qilinadi, yangi worker'lar
+# tayyor bytecode'ni o'qiydi ('' = o'chiq)
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(BASE_DIR, '.jinja_cache'))
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+# Worker turi (gunicorn.conf.py bilan bir xil o'zgaruvchi)
+SERVE_MODE = os.environ.get('SERVE_MODE', 'sync')
+
+# Sahifalash
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 24))
+MAX_PAGE_SIZE = 100
+
 # Fayl turlari uchun ruxsat etilgan kengaytmalar
 ALLOWED_EXTENSIONS = {
     'book': {'pdf', 'epub', 'mobi', 'djvu', 'fb2', 'doc', 'docx', 'txt'},
@@ -30,17 +100,566 @@ ALLOWED_EXTENSIONS = {
 # ========================
 # DATABASE FUNKSIYALARI
 # ========================
-def get_db():
-    """Ma'lumotlar bazasiga ulanish"""
-    conn = sqlite3.connect(DB_PATH)
+# Ulanishlar pool'i sozlamalari
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))  # ms
+DB_CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', -16000))  # manfiy = KiB
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 128 * 1024 * 1024))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+
+class PooledConnection(sqlite3.Connection):
+    """Pool'ga qaytariladigan ulanish.
+
+    So'rov ichida close() hech narsa qilmaydi - ulanishni teardown_appcontext
+    qaytaradi. So'rovdan tashqarida close() ulanishni pool'ga qaytaradi.
+    """
+    request_bound = False
+
+    def close(self):
+        if self.request_bound:
+            return
+        release_db(self)
+
+    def discard(self):
+        """Ulanishni haqiqatan yopish"""
+        sqlite3.Connection.close(self)
+
+    # SQL vaqtini o'lchash (METRIKALAR bo'limi). SELECT uchun execute() birinchi
+    # qatorgacha bo'lgan ishni o'z ichiga oladi - qolgan fetch o'lchanmaydi.
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Connection.execute(self, sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_sql(sql, elapsed)
+            if SQL_PROFILE:
+                profile_sql(self, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Connection.executemany(self, sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_sql(sql, elapsed)
+            if SQL_PROFILE:
+                profile_sql(self, sql, None, elapsed)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            sqlite3.Connection.commit(self)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_sql('COMMIT', elapsed)
+            if SQL_PROFILE:
+                profile_sql(self, 'COMMIT', None, elapsed)
+
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_db_pool_pid = os.getpid()
+
+def _connect():
+    """Yangi ulanish ochish va PRAGMA'larni bir marta sozlash"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT / 1000,
+        factory=PooledConnection,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
-def init_db():
-    """Ma'lumotlar bazasini yaratish va boshlang'ich ma'lumotlarni qo'shish"""
-    db = get_db()
-    cur = db.cursor()
-    
+def _check_pool_pid():
+    """Fork'dan keyin (gunicorn worker) ota jarayon ulanishlarini ishlatmaslik"""
+    global _db_pool, _db_pool_pid
+    if _db_pool_pid != os.getpid():
+        _db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _db_pool_pid = os.getpid()
+
+def acquire_db():
+    """Pool'dan ulanish olish (bo'sh bo'lsa yangisini ochish)"""
+    _check_pool_pid()
+    try:
+        conn = _db_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    conn.request_bound = False
+    return conn
+
+def release_db(conn):
+    """Ulanishni pool'ga qaytarish"""
+    _check_pool_pid()
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.request_bound = False
+        _db_pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.discard()
+
+def get_db():
+    """Ma'lumotlar bazasiga ulanish
+
+    So'rov davomida bitta ulanish ishlatiladi (flask.g da saqlanadi).
+    """
+    if not has_app_context():
+        return acquire_db()
+    if 'db' not in g:
+        conn = acquire_db()
+        conn.request_bound = True
+        g.db = conn
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exc):
+    """So'rov oxirida ulanishni pool'ga qaytarish"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        release_db(conn)
+
+# ========================
+# KO'RISHLAR BUFERI (write-behind)
+# ========================
+VIEW_FLUSH_SIZE = int(os.environ.get('VIEW_FLUSH_SIZE', 200))
+VIEW_FLUSH_INTERVAL = float(os.environ.get('VIEW_FLUSH_INTERVAL', 5))  # soniya
+
+class ViewBuffer:
+    """Ko'rishlarni xotirada yig'ib, bitta tranzaksiyada bazaga yozish.
+
+    Buferni hajm (VIEW_FLUSH_SIZE) yoki vaqt (VIEW_FLUSH_INTERVAL) bo'yicha
+    yoki jarayon to'xtaganda (atexit) bazaga yoziladi.
+    """
+
+    def __init__(self, max_size, interval):
+        self.max_size = max_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = {}
+        self._history = []
+        self._last_flush = time.monotonic()
+        self._pid = None
+
+    def add(self, material_id, user_id):
+        """Bitta ko'rishni buferga qo'shish"""
+        self._ensure_timer()
+        with self._lock:
+            self._counts[material_id] = self._counts.get(material_id, 0) + 1
+            self._history.append((material_id, user_id, datetime.datetime.utcnow().isoformat(), material_id))
+            due = (len(self._history) >= self.max_size
+                   or time.monotonic() - self._last_flush >= self.interval)
+        if due:
+            self.flush()
+
+    def pending(self, material_id):
+        """Hali yozilmagan ko'rishlar soni"""
+        with self._lock:
+            return self._counts.get(material_id, 0)
+
+    def flush(self):
+        """Buferni bitta tranzaksiyada bazaga yozish"""
+        with self._flush_lock:
+            with self._lock:
+                counts, history = self._counts, self._history
+                self._counts, self._history = {}, []
+                self._last_flush = time.monotonic()
+            if not history:
+                return 0
+            conn = acquire_db()
+            try:
+                with conn:
+                    conn.executemany(
+                        "UPDATE materials SET view_count = view_count + ? WHERE id=?",
+                        [(n, material_id) for material_id, n in counts.items()]
+                    )
+                    # O'chirilgan materiallar uchun tarix yozilmaydi
+                    conn.executemany(
+                        "INSERT INTO view_history (material_id, user_id, viewed_at) "
+                        "SELECT ?,?,? WHERE EXISTS (SELECT 1 FROM materials WHERE id=?)",
+                        history
+                    )
+            except sqlite3.Error as e:
+                logging.warning(f"View buffer flush failed, retrying later: {e}")
+                with self._lock:
+                    for material_id, n in counts.items():
+                        self._counts[material_id] = self._counts.get(material_id, 0) + n
+                    self._history[:0] = history
+                return 0
+            finally:
+                release_db(conn)
+            return len(history)
+
+    def _ensure_timer(self):
+        """Har bir jarayonda fon oqimini bir marta ishga tushirish"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Fork'dan oldin yig'ilgan ko'rishlar ota jarayonda yoziladi
+            self._counts, self._history = {}, []
+        threading.Thread(target=self._run, name="view-buffer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("View buffer flush failed")
+
+view_buffer = ViewBuffer(VIEW_FLUSH_SIZE, VIEW_FLUSH_INTERVAL)
+atexit.register(view_buffer.flush)
+
+# ========================
+# METRIKALAR (Prometheus)
+# ========================
+# Har bir jarayon qiymatlarni xotirada yig'adi va METRICS_DIR/<pid>.json ga vaqti-vaqti
+# bilan yozadi. /metrics barcha worker'lar fayllarini qo'shib beradi; to'xtagan worker'lar
+# counter/histogram'lari _dead.json ga o'tkaziladi, shuning uchun yig'indi kamaymaydi.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '.metrics'))  # '' = faqat shu jarayon
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2))  # soniya
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # bo'lsa: Authorization: Bearer <token>
+METRICS_PREFIX = 'donishgoh_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+# nom -> (tur, tavsif, bucket'lar)
+METRIC_TYPES = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time until the response is ready (streamed bodies are not included).', LATENCY_BUCKETS),
+    'http_requests_in_progress': ('gauge', 'Requests currently being handled.', None),
+    'download_bytes_total': ('counter', 'Bytes served by /download (proxy-offloaded files are not included).', None),
+    'upload_bytes_total': ('counter', 'Request body bytes received by the upload routes.', None),
+    'sql_queries_total': ('counter', 'SQL statements executed, by endpoint and operation.', None),
+    'sql_query_seconds_total': ('counter', 'Time spent executing SQL, by endpoint.', None),
+    'sql_query_duration_seconds': ('histogram', 'SQL statement latency by operation.', SQL_BUCKETS),
+}
+UPLOAD_ENDPOINTS = {'admin_add_material', 'admin_edit_material', 'admin_upload_chunk'}
+SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', 'BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA'}
+_sql_operations = {}
+
+def sql_operation(sql):
+    """So'rov turi (birinchi kalit so'z) - label qiymatlari soni cheklangan"""
+    op = _sql_operations.get(sql)
+    if op is None:
+        words = sql.split(None, 1)
+        op = words[0].upper() if words else ''
+        if op not in SQL_OPERATIONS:
+            op = 'OTHER'
+        if len(_sql_operations) < 4096:
+            _sql_operations[sql] = op
+    return op
+
+def metrics_endpoint_label():
+    """Marshrut nomi (URL emas - label'lar soni cheklangan bo'lishi uchun)"""
+    if not has_request_context():
+        return 'background'
+    return request.endpoint or '<unmatched>'
+
+class Metrics:
+    """Jarayon ichidagi counter, gauge va histogram'lar.
+
+    Qiymatlar {(nom, label'lar): son} ko'rinishida saqlanadi; histogram uchun son o'rniga
+    [har bir bucket soni..., +Inf soni, yig'indi] ro'yxati.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._values = {}
+        self._dirty = False
+        self._pid = None
+
+    def inc(self, name, labels=(), value=1):
+        self._ensure_timer()
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, labels, value):
+        self._ensure_timer()
+        with self._lock:
+            self._observe(name, labels, value)
+            self._dirty = True
+
+    def _observe(self, name, labels, value):
+        buckets = METRIC_TYPES[name][2]
+        hist = self._values.get((name, labels))
+        if hist is None:
+            hist = self._values[(name, labels)] = [0] * (len(buckets) + 2)
+        hist[bisect.bisect_left(buckets, value)] += 1
+        hist[-1] += value
+
+    def observe_sql(self, sql, seconds):
+        """Bitta SQL buyrug'i (PooledConnection.execute/executemany/commit dan)"""
+        self._ensure_timer()
+        op = sql_operation(sql)
+        endpoint = metrics_endpoint_label()
+        counted = ('sql_queries_total', (('endpoint', endpoint), ('operation', op)))
+        timed = ('sql_query_seconds_total', (('endpoint', endpoint),))
+        with self._lock:
+            self._values[counted] = self._values.get(counted, 0) + 1
+            self._values[timed] = self._values.get(timed, 0) + seconds
+            self._observe('sql_query_duration_seconds', (('operation', op),), seconds)
+            self._dirty = True
+
+    def value(self, name, labels=()):
+        """Shu jarayondagi bitta qiymat"""
+        return self._values.get((name, labels), 0)
+
+    def values(self):
+        """Shu jarayon qiymatlari nusxasi"""
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    def flush(self):
+        """Qiymatlarni METRICS_DIR/<pid>.json ga yozish (atomik almashtirish)"""
+        if not self.directory:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = [[name, labels, value] for (name, labels), value in self._values.items()]
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(f"{path}.tmp", 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                logging.warning(f"Metrics flush failed: {e}")
+                self._dirty = True
+
+    def _ensure_timer(self):
+        """Har bir jarayonda fon oqimini bir marta ishga tushirish"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Fork'dan oldingi (masalan, --preload) qiymatlar ota jarayonga tegishli
+            self._values = {}
+        if self.directory:
+            threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+metrics = Metrics(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+atexit.register(metrics.flush)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge_metrics(totals, entries, skip_gauges=False):
+    for name, labels, value in entries:
+        if name not in METRIC_TYPES or (skip_gauges and METRIC_TYPES[name][0] == 'gauge'):
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def _read_metrics_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def collect_metrics():
+    """Barcha worker'lar qiymatlari yig'indisi: {(nom, label'lar): qiymat}"""
+    metrics.flush()
+    if not METRICS_DIR:
+        return metrics.values()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    totals = {}
+    dead_path = os.path.join(METRICS_DIR, '_dead.json')
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock:
+        # Bir vaqtda ikki worker _dead.json ni yangilamasligi uchun
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = {}
+        _merge_metrics(dead, _read_metrics_file(dead_path))
+        retired = []
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith('.json') or not name[:-5].isdigit():
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            entries = _read_metrics_file(path)
+            if _pid_alive(int(name[:-5])):
+                _merge_metrics(totals, entries)
+            else:
+                _merge_metrics(dead, entries, skip_gauges=True)
+                retired.append(path)
+        if retired:
+            with open(f"{dead_path}.tmp", 'w') as f:
+                json.dump([[name, labels, value] for (name, labels), value in dead.items()], f)
+            os.replace(f"{dead_path}.tmp", dead_path)
+            for path in retired:
+                os.remove(path)
+    _merge_metrics(totals, [[name, labels, value] for (name, labels), value in dead.items()])
+    return totals
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def render_metrics(values):
+    """Prometheus matn formati (0.0.4)"""
+    by_name = collections.defaultdict(list)
+    for (name, labels), value in values.items():
+        by_name[name].append((labels, value))
+    lines = []
+    for name, (kind, help_text, buckets) in METRIC_TYPES.items():
+        full = METRICS_PREFIX + name
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+        for labels, value in sorted(by_name.get(name, [])):
+            if kind != 'histogram':
+                lines.append(f"{full}{_format_labels(labels)} {value:g}")
+                continue
+            cumulative = 0
+            for le, n in zip(buckets + (float('inf'),), value):
+                cumulative += n
+                bound = '+Inf' if le == float('inf') else f"{le:g}"
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {value[-1]:g}")
+            lines.append(f"{full}_count{_format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def metrics_request_started():
+    g.metrics_started = time.perf_counter()
+    metrics.inc('http_requests_in_progress')
+
+@app.after_request
+def metrics_request_finished(response):
+    """Javob tayyor bo'lganda: holat, kechikish va fayl hajmlari"""
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    endpoint = metrics_endpoint_label()
+    metrics.observe('http_request_duration_seconds', (('endpoint', endpoint), ('method', request.method)),
+                    time.perf_counter() - started)
+    metrics.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                        ('status', str(response.status_code))))
+    if endpoint == 'download_file' and response.status_code in (200, 206) and response.content_length:
+        metrics.inc('download_bytes_total', value=response.content_length)
+    elif endpoint in UPLOAD_ENDPOINTS and response.status_code < 400 and request.content_length:
+        metrics.inc('upload_bytes_total', (('endpoint', endpoint),), request.content_length)
+    return response
+
+@app.teardown_request
+def metrics_request_done(exc):
+    if g.pop('metrics_started', None) is not None:
+        metrics.inc('http_requests_in_progress', value=-1)
+
+@app.route("/metrics")
+def metrics_view():
+    """Prometheus uchun metrikalar (barcha worker'lar yig'indisi)"""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        abort(401)
+    return Response(render_metrics(collect_metrics()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# ========================
+# SQL PROFILER (development / staging)
+# ========================
+# SQL_PROFILE=1 bo'lganda har bir so'rovdagi SQL soni va vaqti Server-Timing header'ida
+# qaytariladi, sekin so'rovlar parametrlari, marshrut va EXPLAIN QUERY PLAN bilan
+# log'ga yoziladi, to'liq jadval skaneri va bitta so'rovning ko'p marta takrorlanishi
+# (N+1) ogohlantiriladi. O'chiq bo'lsa - faqat bitta shart tekshiruvi.
+SQL_PROFILE = os.environ.get('SQL_PROFILE', '0') == '1'
+SQL_SLOW_MS = float(os.environ.get('SQL_SLOW_MS', 20))
+SQL_REPEAT_WARN = int(os.environ.get('SQL_REPEAT_WARN', 5))  # bir so'rovda shuncha marta = N+1 ehtimoli
+SQL_PLAN_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH'}
+
+sql_log = logging.getLogger('sql')
+_sql_plans = {}  # sql -> EXPLAIN QUERY PLAN (har bir jarayonda bir marta)
+
+def _short_sql(sql, limit=300):
+    sql = ' '.join(sql.split())
+    return sql if len(sql) <= limit else sql[:limit] + '…'
+
+def _explain(conn, sql, parameters):
+    """So'rov rejasi (keshlangan); birinchi marta to'liq skaner bo'lsa ogohlantirish"""
+    if sql in _sql_plans:
+        return _sql_plans[sql]
+    plan = None
+    if sql_operation(sql) in SQL_PLAN_OPERATIONS and parameters is not None:
+        try:
+            plan = query_plan(conn, sql, parameters)
+        except sqlite3.Error:
+            pass
+    _sql_plans[sql] = plan
+    problems = plan_problems(plan or [])
+    if problems:
+        sql_log.warning(f"Full scan in {metrics_endpoint_label()}: {_short_sql(sql)} | {' | '.join(problems)}")
+    return plan
+
+def profile_sql(conn, sql, parameters, seconds):
+    """Bitta SQL buyrug'ini profiler'ga yozish (PooledConnection dan)"""
+    plan = _explain(conn, sql, parameters)
+    if has_request_context():
+        stats = g.get('sql_profile')
+        if stats is None:
+            stats = g.sql_profile = {'count': 0, 'seconds': 0.0, 'statements': collections.Counter()}
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['statements'][sql] += 1
+    if seconds * 1000 >= SQL_SLOW_MS:
+        params = '-' if parameters is None else repr(parameters)[:200]
+        sql_log.warning(f"Slow SQL {seconds * 1000:.1f}ms in {metrics_endpoint_label()}: {_short_sql(sql)} "
+                        f"params={params} plan={' | '.join(plan) if plan else '-'}")
+
+@app.after_request
+def sql_profile_summary(response):
+    """So'rov bo'yicha SQL xulosasi: Server-Timing header va N+1 ogohlantirishi"""
+    if not SQL_PROFILE:
+        return response
+    stats = g.pop('sql_profile', None) or {'count': 0, 'seconds': 0.0, 'statements': {}}
+    response.headers.add('Server-Timing', f'db;dur={stats["seconds"] * 1000:.2f};desc="{stats["count"]} queries"')
+    for sql, n in stats['statements'].items():
+        if n >= SQL_REPEAT_WARN:
+            sql_log.warning(f"Repeated SQL ({n}x, possible N+1) in {metrics_endpoint_label()}: {_short_sql(sql)}")
+    return response
+
+# ========================
+# MIGRATSIYALAR
+# ========================
+# Har bir migratsiya bir marta bajariladi; bajarilganlar soni PRAGMA user_version
+# da saqlanadi. Yangi migratsiya faqat ro'yxat oxiriga qo'shiladi.
+
+def _migration_base_tables(cur):
+    """Asosiy jadvallar"""
     # Users jadval - admin_level qo'shildi (0=oddiy, 1=oddiy admin, 2=bosh admin)
     cur.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -89,31 +708,583 @@ def init_db():
       FOREIGN KEY (material_id) REFERENCES materials(id),
       FOREIGN KEY (user_id) REFERENCES users(id)
     )''')
+
+def _migration_material_counts(cur):
+    """Material turlari bo'yicha hisoblagichlar - bosh sahifa uchun"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS material_counts (
+      material_type TEXT PRIMARY KEY,
+      count INTEGER NOT NULL DEFAULT 0
+    )''')
     
-    db.commit()
+    # Hisoblagichlarni trigger'lar yangilaydi - barcha worker'lar uchun bir xil
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS materials_count_ai AFTER INSERT ON materials BEGIN
+      INSERT OR IGNORE INTO material_counts (material_type, count) VALUES (new.material_type, 0);
+      UPDATE material_counts SET count = count + 1 WHERE material_type = new.material_type;
+    END''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS materials_count_ad AFTER DELETE ON materials BEGIN
+      UPDATE material_counts SET count = count - 1 WHERE material_type = old.material_type;
+    END''')
+
+    # Mavjud bazalar uchun hisoblagichlarni qayta hisoblash
+    cur.execute("DELETE FROM material_counts")
+    cur.execute('''
+    INSERT INTO material_counts (material_type, count)
+    SELECT material_type, COUNT(*) FROM materials GROUP BY material_type''')
+
+def _migration_search_index(cur):
+    """To'liq matnli qidiruv indeksi (FTS5, materials jadvalidan tashqi kontent)"""
+    cur.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS materials_fts USING fts5(
+      title, author, description,
+      content='materials', content_rowid='id',
+      tokenize='unicode61 remove_diacritics 2'
+    )''')
+    
+    # Indeksni trigger'lar sinxron saqlaydi (view_count o'zgarishi indeksga tegmaydi)
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS materials_fts_ai AFTER INSERT ON materials BEGIN
+      INSERT INTO materials_fts (rowid, title, author, description)
+      VALUES (new.id, new.title, new.author, new.description);
+    END''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS materials_fts_ad AFTER DELETE ON materials BEGIN
+      INSERT INTO materials_fts (materials_fts, rowid, title, author, description)
+      VALUES ('delete', old.id, old.title, old.author, old.description);
+    END''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS materials_fts_au AFTER UPDATE OF title, author, description ON materials BEGIN
+      INSERT INTO materials_fts (materials_fts, rowid, title, author, description)
+      VALUES ('delete', old.id, old.title, old.author, old.description);
+      INSERT INTO materials_fts (rowid, title, author, description)
+      VALUES (new.id, new.title, new.author, new.description);
+    END''')
+    
+    # Mavjud materiallarni indekslash
+    cur.execute("INSERT INTO materials_fts (materials_fts) VALUES ('rebuild')")
+
+def _migration_hot_path_indexes(cur):
+    """Tez-tez ishlatiladigan so'rovlar uchun indekslar"""
+    # materials WHERE material_type=? ORDER BY id (kursorli sahifalash)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_materials_type_id ON materials (material_type, id)")
+    # materials WHERE uploaded_by=? ORDER BY id (oddiy admin paneli)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_materials_uploader_id ON materials (uploaded_by, id)")
+    # view_history WHERE material_id=? ORDER BY viewed_at - user_id bilan qoplovchi indeks
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_view_history_material_viewed "
+        "ON view_history (material_id, viewed_at, user_id)"
+    )
+    # notifications WHERE user_id=? ORDER BY id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications (user_id, id)")
+
+def _migration_upload_sessions(cur):
+    """Bo'laklab (davom ettiriladigan) yuklash sessiyalari"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+      id TEXT PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      material_id INTEGER,
+      material_type TEXT NOT NULL,
+      filename TEXT NOT NULL,
+      size INTEGER NOT NULL,
+      created_at TEXT NOT NULL,
+      FOREIGN KEY (user_id) REFERENCES users(id),
+      FOREIGN KEY (material_id) REFERENCES materials(id)
+    )''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_created ON upload_sessions (created_at)")
+
+def _migration_view_rollups(cur):
+    """Ko'rishlar bo'yicha soatlik/kunlik yig'indilar va noyob tomoshabinlar"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS view_rollup_hourly (
+      material_id INTEGER NOT NULL,
+      hour TEXT NOT NULL,
+      views INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (material_id, hour)
+    ) WITHOUT ROWID''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS view_rollup_daily (
+      material_id INTEGER NOT NULL,
+      day TEXT NOT NULL,
+      views INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (material_id, day)
+    ) WITHOUT ROWID''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS material_viewers (
+      material_id INTEGER NOT NULL,
+      user_id INTEGER NOT NULL,
+      first_seen TEXT NOT NULL,
+      PRIMARY KEY (material_id, user_id)
+    ) WITHOUT ROWID''')
+    
+    # Yig'indilarni view_history ga yozilgan har bir qator yangilaydi.
+    # viewed_at ISO ('...T...') yoki CURRENT_TIMESTAMP ('... ...') bo'lishi mumkin.
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS view_history_rollup_ai AFTER INSERT ON view_history BEGIN
+      INSERT INTO view_rollup_hourly (material_id, hour, views)
+      VALUES (new.material_id, replace(substr(new.viewed_at, 1, 13), ' ', 'T'), 1)
+      ON CONFLICT (material_id, hour) DO UPDATE SET views = views + 1;
+      INSERT INTO view_rollup_daily (material_id, day, views)
+      VALUES (new.material_id, substr(new.viewed_at, 1, 10), 1)
+      ON CONFLICT (material_id, day) DO UPDATE SET views = views + 1;
+      INSERT OR IGNORE INTO material_viewers (material_id, user_id, first_seen)
+      SELECT new.material_id, new.user_id, new.viewed_at WHERE new.user_id IS NOT NULL;
+    END''')
+    
+    # Mavjud tarixdan to'ldirish
+    cur.execute('''
+    INSERT OR REPLACE INTO view_rollup_hourly (material_id, hour, views)
+    SELECT material_id, replace(substr(viewed_at, 1, 13), ' ', 'T'), COUNT(*)
+    FROM view_history GROUP BY 1, 2''')
+    cur.execute('''
+    INSERT OR REPLACE INTO view_rollup_daily (material_id, day, views)
+    SELECT material_id, substr(viewed_at, 1, 10), COUNT(*)
+    FROM view_history GROUP BY 1, 2''')
+    cur.execute('''
+    INSERT OR IGNORE INTO material_viewers (material_id, user_id, first_seen)
+    SELECT material_id, user_id, MIN(viewed_at)
+    FROM view_history WHERE user_id IS NOT NULL GROUP BY 1, 2''')
+    
+    # Statistika sahifasi endi tarixni id bo'yicha sahifalaydi
+    cur.execute("DROP INDEX IF EXISTS idx_view_history_material_viewed")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_view_history_material_id ON view_history (material_id, id)")
+
+def _migration_jobs(cur):
+    """Fon vazifalari navbati va fayl metama'lumotlari ustunlari"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      kind TEXT NOT NULL,
+      payload TEXT NOT NULL DEFAULT '{}',
+      priority INTEGER NOT NULL DEFAULT 0,
+      status TEXT NOT NULL DEFAULT 'queued',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      max_attempts INTEGER NOT NULL DEFAULT 5,
+      run_at REAL NOT NULL,
+      locked_by TEXT,
+      locked_until REAL,
+      last_error TEXT,
+      created_at REAL NOT NULL,
+      started_at REAL,
+      finished_at REAL
+    )''')
+    # Navbatdan olish: status='queued' ORDER BY priority DESC, run_at, id
+    # Muddati o'tganlarni qaytarish: status='running' AND locked_until < ?
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, run_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL")
+    
+    cur.execute("ALTER TABLE materials ADD COLUMN file_size INTEGER")
+    cur.execute("ALTER TABLE materials ADD COLUMN checksum TEXT")
+    cur.execute("ALTER TABLE materials ADD COLUMN mime_type TEXT")
+
+def _migration_page_versions(cur):
+    """Sahifa keshi uchun versiyalar - materials o'zgarganda triggerlar oshiradi"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS page_versions (
+      tag TEXT PRIMARY KEY,
+      version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    
+    def bump(tag):
+        return (f"INSERT INTO page_versions (tag, version) VALUES ({tag}, 1) "
+                f"ON CONFLICT (tag) DO UPDATE SET version = version + 1;")
+    
+    # 'counts' - bosh sahifa, 'materials' - ro'yxatlar, 'material:<id>' - tafsilotlar sahifasi.
+    # view_count o'zgarishi keshni buzmaydi (PAGE_CACHE_TTL bilan yangilanadi).
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS materials_page_ai AFTER INSERT ON materials BEGIN
+      {bump("'counts'")}
+      {bump("'materials'")}
+    END''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS materials_page_ad AFTER DELETE ON materials BEGIN
+      {bump("'counts'")}
+      {bump("'materials'")}
+      {bump("'material:' || old.id")}
+    END''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS materials_page_au
+    AFTER UPDATE OF title, author, description, filename, material_type ON materials BEGIN
+      {bump("'materials'")}
+      {bump("'material:' || new.id")}
+    END''')
+    cur.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS materials_page_type_au AFTER UPDATE OF material_type ON materials BEGIN
+      {bump("'counts'")}
+    END''')
+
+def _migration_unread_notifications(cur):
+    """O'qilmagan bildirishnomalarni sanash uchun qisman indeks"""
+    cur.execute("UPDATE notifications SET is_read = 0 WHERE is_read IS NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications (user_id) WHERE is_read = 0")
+
+def _migration_broadcasts(cur):
+    """Ommaviy xabarlar: matn bir marta, har bir foydalanuvchi uchun faqat yetkazish qatori"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      segment TEXT NOT NULL,
+      title TEXT NOT NULL,
+      message TEXT NOT NULL,
+      created_at TEXT NOT NULL,
+      sent_by INTEGER NOT NULL,
+      FOREIGN KEY (sent_by) REFERENCES users(id)
+    )''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+      user_id INTEGER NOT NULL,
+      broadcast_id INTEGER NOT NULL,
+      is_read INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (user_id, broadcast_id)
+    ) WITHOUT ROWID''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_unread ON broadcast_deliveries (user_id, is_read) WHERE is_read = 0")
+
+def _migration_storage_keys(cur):
+    """Fayl kaliti bo'yicha qidirish: delete_file tekshiruvi va migrate-storage"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_materials_filename ON materials (filename) WHERE filename IS NOT NULL")
+
+def _migration_upload_commit(cur):
+    """Yakunlangan sessiya o'chirilmaydi - takroriy commit o'sha materialni qaytaradi"""
+    cur.execute("ALTER TABLE upload_sessions ADD COLUMN committed_material_id INTEGER")
+
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_material_counts,
+    _migration_search_index,
+    _migration_hot_path_indexes,
+    _migration_upload_sessions,
+    _migration_view_rollups,
+    _migration_jobs,
+    _migration_page_versions,
+    _migration_unread_notifications,
+    _migration_broadcasts,
+    _migration_storage_keys,
+    _migration_upload_commit,
+]
+
+def migrate(db):
+    """Bazani oxirgi versiyagacha yangilash.
+
+    Har bir migratsiya alohida BEGIN IMMEDIATE tranzaksiyasida bajariladi, shuning
+    uchun bir vaqtda ishga tushgan gunicorn worker'lari bir-birini kutadi.
+    """
+    while True:
+        db.execute("BEGIN IMMEDIATE")
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            db.rollback()
+            return version
+        try:
+            MIGRATIONS[version](db.cursor())
+            db.execute(f"PRAGMA user_version={version + 1}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logging.info(f"Database migrated to version {version + 1}")
+
+def init_db():
+    """Ma'lumotlar bazasini yaratish va boshlang'ich ma'lumotlarni qo'shish"""
+    db = get_db()
+    migrate(db)
+    cur = db.cursor()
     
     # Bosh adminni yaratish (agar mavjud bo'lmasa)
+    # (INSERT OR IGNORE - bir vaqtda ishga tushgan worker'lar to'qnashmasligi uchun)
     cur.execute("SELECT id FROM users WHERE email=?", ('admin@local',))
     if not cur.fetchone():
-        cur.execute("INSERT INTO users (name, email, password, admin_level) VALUES (?,?,?,?)",
+        cur.execute("INSERT OR IGNORE INTO users (name, email, password, admin_level) VALUES (?,?,?,?)",
                     ("Сардори админ", "admin@local", generate_password_hash("admin123"), 2))
         db.commit()
-        print("✅ Сардори маъмурӣ: admin@local / admin123")
+        if cur.rowcount:
+            print("✅ Сардори маъмурӣ: admin@local / admin123")
     
     db.close()
 
+# Marshrutlardagi asosiy so'rovlar - ularning rejasi indeksdan foydalanishi shart.
+# Marshrutlar so'rov matnini shu yerdan oladi, check-query-plans ham aynan shuni tekshiradi.
+HOT_QUERIES = {
+    'materials_by_type': "SELECT * FROM materials WHERE material_type=?",
+    'materials_all': "SELECT * FROM materials WHERE 1",
+    'material_detail': ("SELECT m.*, u.name AS uploader_name FROM materials m "
+                        "LEFT JOIN users u ON u.id = m.uploaded_by WHERE m.id=?"),
+    'admin_own_materials': "SELECT * FROM materials WHERE uploaded_by=? ORDER BY id DESC",
+    'material_views': """
+        SELECT view_history.*, users.name
+        FROM view_history
+        LEFT JOIN users ON view_history.user_id = users.id
+        WHERE material_id=?""",
+    'job_claim': "SELECT * FROM jobs WHERE status='queued' AND run_at <= ? ORDER BY priority DESC, run_at, id LIMIT 1",
+    'job_reclaim': "SELECT id, attempts, max_attempts FROM jobs WHERE status='running' AND locked_until < ?",
+    'material_daily_views': "SELECT day, views FROM view_rollup_daily WHERE material_id=? AND day >= ? ORDER BY day",
+    'material_hourly_views': "SELECT hour, views FROM view_rollup_hourly WHERE material_id=? AND hour >= ? ORDER BY hour",
+    'material_viewers': "SELECT COUNT(*) FROM material_viewers WHERE material_id=?",
+    'notifications_direct': ("SELECT id, title, message, created_at, is_read, 'direct' AS kind FROM notifications "
+                             "WHERE user_id=? AND id < ? ORDER BY id DESC LIMIT ?"),
+    'notifications_broadcast': """
+        SELECT broadcasts.id, title, message, created_at, is_read, 'broadcast' AS kind
+        FROM broadcast_deliveries JOIN broadcasts ON broadcasts.id = broadcast_deliveries.broadcast_id
+        WHERE broadcast_deliveries.user_id=? AND broadcast_id < ? ORDER BY broadcast_id DESC LIMIT ?""",
+    'unread_count': ("SELECT (SELECT COUNT(*) FROM notifications WHERE user_id=? AND is_read=0)"
+                     " + (SELECT COUNT(*) FROM broadcast_deliveries WHERE user_id=? AND is_read=0)"),
+    'notifications_since': "SELECT id, title, message, created_at FROM notifications WHERE user_id=? AND id > ? ORDER BY id",
+    'broadcasts_since': """
+        SELECT broadcasts.id, title, message, created_at
+        FROM broadcast_deliveries JOIN broadcasts ON broadcasts.id = broadcast_deliveries.broadcast_id
+        WHERE broadcast_deliveries.user_id=? AND broadcast_id > ? ORDER BY broadcast_id""",
+    'login': "SELECT * FROM users WHERE email=?",
+    'file_in_use': "SELECT 1 FROM materials WHERE filename=? LIMIT 1",
+    'storage_keys': ("SELECT DISTINCT filename FROM materials WHERE filename IS NOT NULL AND filename > ? "
+                     "ORDER BY filename LIMIT ?"),
+    'health_queue': ("SELECT COUNT(*) FILTER (WHERE status='queued' AND run_at <= ?),"
+                     " MIN(run_at) FILTER (WHERE status='queued' AND run_at <= ?),"
+                     " COUNT(*) FILTER (WHERE status='running')"
+                     " FROM jobs WHERE status IN ('queued', 'running')"),
+}
+
+# keyset_page asoslari va ularning kalit ustuni - barcha yo'nalishdagi to'liq so'rov tekshiriladi
+KEYSET_QUERIES = {
+    'materials_by_type': 'id',
+    'materials_all': 'id',
+    'material_views': 'view_history.id',
+}
+
+# Filtrsiz birinchi sahifa: jadval rowid tartibida o'qiladi va LIMIT da to'xtaydi -
+# SCAN bu yerda muammo emas (vaqtinchalik saralash bo'lmasa)
+ORDERED_SCANS = {'materials_all[first]'}
+
+# Rejani olish uchun namunaviy parametrlar (keyset so'rovlar uchun - faqat asos parametrlari)
+HOT_QUERY_SAMPLES = {
+    'materials_by_type': ('book',),
+    'materials_all': (),
+    'material_detail': (1,),
+    'admin_own_materials': (1,),
+    'material_views': (1,),
+    'job_claim': (0,),
+    'job_reclaim': (0,),
+    'material_daily_views': (1, '2026-01-01'),
+    'material_hourly_views': (1, '2026-01-01T00'),
+    'material_viewers': (1,),
+    'notifications_direct': (1, 1000, 51),
+    'notifications_broadcast': (1, 1000, 51),
+    'unread_count': (1, 1),
+    'notifications_since': (1, 0),
+    'broadcasts_since': (1, 0),
+    'login': ('admin@local',),
+    'file_in_use': ('ab/cd/abcd-x.pdf',),
+    'storage_keys': ('', 1000),
+    'health_queue': (0, 0),
+}
+
+def hot_query_variants(name):
+    """Tekshiriladigan (nom, so'rov, parametrlar); keyset asoslari uch ko'rinishda"""
+    sql, params = HOT_QUERIES[name], tuple(HOT_QUERY_SAMPLES[name])
+    key = KEYSET_QUERIES.get(name)
+    if key is None:
+        return [(name, sql, params)]
+    return [
+        (f"{name}[first]", keyset_sql(sql, key), params + (25,)),
+        (f"{name}[before]", keyset_sql(sql, key, before=True), params + (1000, 25)),
+        (f"{name}[after]", keyset_sql(sql, key, after=True), params + (1000, 25)),
+    ]
+
+def query_plan(db, sql, params=()):
+    """EXPLAIN QUERY PLAN natijasini satrlar ro'yxati sifatida olish (metrika/profiler'ga yozilmaydi)"""
+    return [row[3] for row in sqlite3.Connection.execute(db, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+def plan_problems(plan):
+    """Rejadagi to'liq jadval skanerlari va vaqtinchalik saralashlar"""
+    return [step for step in plan
+            if (step.startswith('SCAN ') and ' USING ' not in step
+                and step != 'SCAN CONSTANT ROW' and ' VIRTUAL TABLE INDEX ' not in step)
+            or 'TEMP B-TREE' in step]
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """HOT_QUERIES rejalarini tekshirish; indekssiz so'rov bo'lsa xato bilan chiqadi"""
+    init_db()
+    db = get_db()
+    failed = False
+    for query in HOT_QUERIES:
+        for name, sql, params in hot_query_variants(query):
+            plan = query_plan(db, sql, params)
+            problems = plan_problems(plan)
+            if name in ORDERED_SCANS:
+                problems = [step for step in problems if 'TEMP B-TREE' in step]
+            failed = failed or bool(problems)
+            print(f"{'❌' if problems else '✅'} {name}: {' | '.join(plan)}")
+    db.close()
+    if failed:
+        raise SystemExit(1)
+
+def rebuild_search_index():
+    """Qidiruv indeksini materials jadvalidan qayta qurish"""
+    db = get_db()
+    db.execute("INSERT INTO materials_fts (materials_fts) VALUES ('rebuild')")
+    db.commit()
+    count = db.execute("SELECT COUNT(*) FROM materials").fetchone()[0]
+    db.close()
+    return count
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Mavjud bazalar uchun qidiruv indeksini qayta qurish"""
+    init_db()
+    print(f"✅ Qidiruv indeksi qayta qurildi: {rebuild_search_index()} ta material")
+
+# ========================
+# PAROL XESHLASH (alohida jarayonlar pool'i)
+# ========================
+# PBKDF2/scrypt CPU'ni band qiladi. Xeshlash past ustuvorlikdagi (nice) jarayonlarda
+# bajariladi va navbat cheklangan, shuning uchun login oqimi katalogni sekinlashtirmaydi.
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 1))  # 0 = so'rov ichida (eski usul)
+HASH_MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', 4))
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', 5))  # soniya
+HASH_NICE = int(os.environ.get('HASH_NICE', 10))
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+class HashingBusy(Exception):
+    """Xeshlash navbati to'la yoki kutish vaqti tugadi"""
+
+class PasswordHasher:
+    """Cheklangan jarayonlar pool'ida parol xeshlash va tekshirish"""
+
+    def __init__(self, workers, max_pending, queue_timeout, method, nice=0):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.method = method
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._current_prefix = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=os.nice, initargs=(self.nice,),
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy()
+        try:
+            future = self._executor().submit(fn, *args)
+        except concurrent.futures.BrokenExecutor:
+            self._slots.release()
+            with self._lock:
+                self._pool = None
+            raise HashingBusy()
+        except BaseException:
+            self._slots.release()
+            raise
+        # Slot ish haqiqatan tugaganda (yoki bekor qilinganda) qaytadi - kutishni tashlab
+        # ketilgan vazifalar ham HASH_MAX_PENDING ga kiradi
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.queue_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()  # Hali navbatda bo'lsa - hech kim kutmayotgan ishni bajarmaymiz
+            raise HashingBusy()
+        except concurrent.futures.BrokenExecutor:
+            with self._lock:
+                self._pool = None
+            raise HashingBusy()
+
+    def hash(self, password):
+        """Yangi xesh (joriy parametrlar bilan)"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Parolni tekshirish"""
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Xesh eski usul/parametrlar bilan yaratilganmi ("method:params$salt$hash")"""
+        if self._current_prefix is None:
+            self._current_prefix = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._current_prefix
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(HASH_WORKERS, HASH_MAX_PENDING, HASH_QUEUE_TIMEOUT,
+                                 PASSWORD_HASH_METHOD, HASH_NICE)
+atexit.register(password_hasher.shutdown)
+
 # ========================
 # HELPER FUNKSIYALAR
 # ========================
-def current_user():
-    """Hozirgi foydalanuvchini olish"""
-    if not session.get('user_id'):
-        return None
+# Foydalanuvchi qatorlari uchun jarayon ichidagi qisqa muddatli kesh.
+# admin_toggle_user o'z worker'ida darhol tozalaydi; boshqa worker'larda
+# o'zgarish ko'pi bilan USER_CACHE_TTL soniyadan keyin ko'rinadi.
+# Hajmi USER_CACHE_SIZE bilan cheklangan (LRU) - kirgan har bir foydalanuvchi xotirada qolmaydi.
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+_user_cache = collections.OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def invalidate_user(user_id):
+    """Foydalanuvchini keshdan o'chirish"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+def _load_user(user_id):
+    """Foydalanuvchini keshdan yoki bazadan olish"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached and cached[0] > now:
+            _user_cache.move_to_end(user_id)
+            return cached[1]
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE id=?", (session['user_id'],)).fetchone()
+    user = db.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
     db.close()
+    if user is not None and USER_CACHE_TTL > 0 and USER_CACHE_SIZE > 0:
+        with _user_cache_lock:
+            _user_cache[user_id] = (now + USER_CACHE_TTL, user)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
     return user
 
+def current_user():
+    """Hozirgi foydalanuvchini olish (so'rov davomida bir marta, flask.g da)"""
+    if not session.get('user_id'):
+        return None
+    if 'user' not in g:
+        g.user = _load_user(session['user_id'])
+        # Imzolangan sessiyadagi admin_level eskirgan bo'lsa yangilash (nav uchun)
+        if g.user is not None and session.get('admin_level') != g.user['admin_level']:
+            session['admin_level'] = g.user['admin_level']
+    return g.user
+
+def count_unread(db, user_id):
+    """Shaxsiy va ommaviy o'qilmagan xabarlar (ikkalasi ham qisman indeksdan)"""
+    return db.execute(HOT_QUERIES['unread_count'], (user_id, user_id)).fetchone()[0]
+
+@app.template_global()
+def unread_count():
+    """Hozirgi foydalanuvchining o'qilmagan xabarlari soni (so'rov davomida bir marta)"""
+    if not session.get('user_id'):
+        return 0
+    if 'unread_count' not in g:
+        db = get_db()
+        g.unread_count = count_unread(db, session['user_id'])
+        db.close()
+    return g.unread_count
+
 def login_required(f):
     """Faqat kirgan foydalanuvchilar uchun"""
     from functools import wraps
@@ -149,6 +1320,44 @@ def main_admin_required(f):
         return f(*args, **kwargs)
     return wrap
 
+def page_limit():
+    """?limit= parametrini cheklangan qiymatga keltirish"""
+    limit = request.args.get('limit', type=int) or PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def keyset_sql(sql, key, before=False, after=False):
+    """keyset_page bajaradigan to'liq so'rov (check-query-plans ham shu orqali tekshiradi)"""
+    if after:
+        return f"{sql} AND {key} > ? ORDER BY {key} ASC LIMIT ?"
+    if before:
+        sql = f"{sql} AND {key} < ?"
+    return f"{sql} ORDER BY {key} DESC LIMIT ?"
+
+def keyset_page(db, sql, params, before=None, after=None, limit=PAGE_SIZE, key='id'):
+    """Kursorli (keyset) sahifalash - natijalar `key` bo'yicha kamayish tartibida.
+
+    `sql` WHERE shartigacha bo'lgan so'rov (masalan "SELECT * FROM t WHERE 1").
+    OFFSET ishlatilmaydi, shuning uchun har bir sahifa narxi bir xil.
+    (rows, prev_after, next_before) qaytaradi; havola kerak bo'lmasa None.
+    """
+    params = list(params)
+    if after is not None:
+        rows = db.execute(keyset_sql(sql, key, after=True), params + [after, limit + 1]).fetchall()
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = True
+    else:
+        if before is not None:
+            params.append(before)
+        rows = db.execute(keyset_sql(sql, key, before=before is not None), params + [limit + 1]).fetchall()
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = before is not None
+    column = key.rsplit('.', 1)[-1]
+    prev_after = rows[0][column] if rows and has_newer else None
+    next_before = rows[-1][column] if rows and has_older else None
+    return rows, prev_after, next_before
+
 def allowed_file(filename, material_type):
     """Faylni tekshirish"""
     if '.' not in filename:
@@ -156,21 +1365,406 @@ def allowed_file(filename, material_type):
     ext = filename.rsplit('.', 1)[1].lower()
     return ext in ALLOWED_EXTENSIONS.get(material_type, set())
 
+# ========================
+# FAYL SAQLASH (storage)
+# ========================
+# materials.filename - storage kaliti: "3f/a9/3fa9c1e2d4b58e71-kitob.pdf". Boshidagi token
+# nom to'qnashuvini yo'qotadi (tekshirish uchun stat kerak emas) va fayllarni 256x256
+# papkaga teng taqsimlaydi. Eski tekis nomlar ("kitob.pdf") ham ishlayveradi;
+# `flask migrate-storage` ularni ko'chiradi.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')  # local | s3
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # MinIO va boshqa S3-mos serverlar
+S3_REGION = os.environ.get('S3_REGION') or None
+S3_URL_EXPIRES = int(os.environ.get('S3_URL_EXPIRES', 300))  # presigned URL muddati (soniya)
+STORAGE_TOKEN_LENGTH = 16  # hex belgilar
+
+def new_storage_key(filename, token=None):
+    """Yangi fayl uchun sharded kalit (token berilmasa - tasodifiy)"""
+    token = (token or secrets.token_hex(STORAGE_TOKEN_LENGTH // 2))[:STORAGE_TOKEN_LENGTH]
+    name = secure_filename(filename) or 'file'
+    return f"{token[:2]}/{token[2:4]}/{token}-{name}"
+
+def is_sharded_key(key):
+    """Kalit yangi (sharded) ko'rinishdami"""
+    parts = key.split('/')
+    return (len(parts) == 3 and parts[2][:2] == parts[0] and parts[2][2:4] == parts[1]
+            and parts[2][STORAGE_TOKEN_LENGTH:STORAGE_TOKEN_LENGTH + 1] == '-')
+
+@app.template_filter('display_name')
+def display_name(key):
+    """Foydalanuvchiga ko'rsatiladigan asl fayl nomi (tokensiz)"""
+    if key and is_sharded_key(key):
+        return key.rsplit('/', 1)[1][STORAGE_TOKEN_LENGTH + 1:]
+    return key
+
+class LocalStorage:
+    """UPLOAD_FOLDER dagi fayllar (kalit - nisbiy yo'l)"""
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        """Kalitning disk yo'li (papkadan tashqariga chiqadigan kalit - ValueError)"""
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f"invalid storage key: {key!r}")
+        return path
+
+    def stat(self, key):
+        """(hajm, o'zgarish vaqti) yoki fayl bo'lmasa None"""
+        try:
+            st = os.stat(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return st.st_size, st.st_mtime
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    @contextlib.contextmanager
+    def local_copy(self, key):
+        """Faylning diskdagi yo'li (Pillow va h.k. uchun) - nusxa kerak emas"""
+        yield self.path(key)
+
+    def scratch_path(self, key):
+        """Keyin save_file(move=True) bilan joylanadigan vaqtinchalik fayl (shu diskda)"""
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def save_file(self, src, key, move=False, link=False):
+        """Diskdagi faylni kalitga joylash; 'moved', 'linked' yoki 'copied' qaytaradi.
+
+        Yarim yozilgan faylni hech kim ko'rmasligi uchun avval vaqtinchalik nom, keyin rename.
+        """
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if move:
+            try:
+                os.replace(src, target)
+                return 'moved'
+            except OSError:
+                pass  # Boshqa disk (EXDEV) - nusxalab, keyin o'chiramiz
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        how = 'copied'
+        if link:
+            try:
+                os.link(src, tmp_path)
+                how = 'linked'
+            except OSError:
+                pass
+        if how == 'copied':
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, target)
+        if move:
+            os.remove(src)
+        return how
+
+    def save_fileobj(self, fileobj, key):
+        """Oqimdan (yuklangan fayl) kalitga yozish"""
+        tmp_path = self.scratch_path(key)
+        try:
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self, after=''):
+        """(kalit, hajm, vaqt) kalitlar satr tartibida, `after` dan keyin.
+
+        Papka ichidagi yozuvlar "nom/" ko'rinishida saralanadi - shunda aylanish tartibi
+        kalitlarning satr tartibi bilan bir xil (bazadagi ORDER BY filename bilan
+        solishtirish uchun). Nuqta bilan boshlanuvchi nomlar (.partial) o'tkaziladi.
+        Vaqt - mtime/ctime dan kattasi (hard-link qilingan fayl uchun ham yangi).
+        """
+        def walk(directory, prefix):
+            with os.scandir(directory) as it:
+                entries = sorted(((e.name + '/' if e.is_dir(follow_symlinks=False) else e.name), e)
+                                 for e in it if not e.name.startswith('.'))
+            for name, entry in entries:
+                key = prefix + name
+                if name.endswith('/'):
+                    # Butun papka kursordan oldin bo'lsa - ichiga kirmaymiz
+                    if key < after and not after.startswith(key):
+                        continue
+                    yield from walk(entry.path, key)
+                elif key > after and entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    yield key, st.st_size, max(st.st_mtime, st.st_ctime)
+        yield from walk(self.root, '')
+
+class S3Storage:
+    """S3 yoki S3-mos (MinIO) bucket; yuklab olish presigned URL orqali, fayl ilova orqali o'tmaydi"""
+    local = False
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _params(self, key):
+        return {'Bucket': self.bucket, 'Key': self.prefix + key}
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(**self._params(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def open(self, key):
+        return self.client.get_object(**self._params(key))['Body']
+
+    @contextlib.contextmanager
+    def local_copy(self, key):
+        """Faylni vaqtinchalik diskka yuklab olish"""
+        fd, path = tempfile.mkstemp(suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.client.download_fileobj(self.bucket, self.prefix + key, f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def scratch_path(self, key):
+        fd, path = tempfile.mkstemp(suffix='.tmp')
+        os.close(fd)
+        return path
+
+    def _extra_args(self, key):
+        return {'ContentType': mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+
+    def save_file(self, src, key, move=False, link=False):
+        self.client.upload_file(src, self.bucket, self.prefix + key, ExtraArgs=self._extra_args(key))
+        if move:
+            os.remove(src)
+        return 'uploaded'
+
+    def save_fileobj(self, fileobj, key):
+        self.client.upload_fileobj(fileobj, self.bucket, self.prefix + key, ExtraArgs=self._extra_args(key))
+
+    def delete(self, key):
+        self.client.delete_object(**self._params(key))
+
+    def iter_keys(self, after=''):
+        """(kalit, hajm, vaqt) - S3 ro'yxati kalitlar tartibida keladi"""
+        params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        if after:
+            params['StartAfter'] = self.prefix + after
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['Size'], obj['LastModified'].timestamp()
+
+    def url(self, key, download_name=None, cache_control=None):
+        """Vaqtinchalik yuklab olish manzili"""
+        params = self._params(key)
+        if download_name:
+            params['ResponseContentDisposition'] = f"attachment; filename*=UTF-8''{url_quote(download_name)}"
+        if cache_control:
+            params['ResponseCacheControl'] = cache_control
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=S3_URL_EXPIRES)
+
+def make_storage():
+    """STORAGE_BACKEND bo'yicha storage obyekti"""
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    return LocalStorage(UPLOAD_FOLDER)
+
+storage = make_storage()
+
+@app.cli.command("migrate-storage")
+@click.option('--batch', default=500, show_default=True, help="Bitta tranzaksiyadagi materiallar")
+@click.option('--keep-local', is_flag=True, help="S3 ga yuklangan fayllarni diskdan o'chirmaslik")
+@click.option('--dry-run', is_flag=True, help="Faqat nechta fayl ko'chishini ko'rsatish")
+def migrate_storage_command(batch, keep_local, dry_run):
+    """UPLOAD_FOLDER dagi tekis nomli fayllarni sharded kalitlarga (yoki S3 ga) ko'chirish.
+
+    Har bir bo'lakda fayl va thumbnail'lar yangi kalitga joylanadi (diskda hard-link),
+    materials.filename bitta tranzaksiyada yangilanadi va shundan keyingina eski fayl
+    o'chiriladi. Yangi kalit eski nomdan olinadi - uzilgan migratsiyani qayta ishga
+    tushirish xavfsiz.
+    """
+    init_db()
+    source = LocalStorage(UPLOAD_FOLDER)
+    db = acquire_db()
+    keys = [r[0] for r in db.execute("SELECT DISTINCT filename FROM materials WHERE filename IS NOT NULL")]
+    plan, absent = [], 0
+    for key in keys:
+        if storage.local and is_sharded_key(key):
+            continue
+        if not source.exists(key):
+            absent += 1  # Yo'qolgan yoki allaqachon S3 da
+            continue
+        new_key = key if is_sharded_key(key) else new_storage_key(
+            key, token=hashlib.sha256(key.encode()).hexdigest())
+        plan.append((key, new_key))
+    print(f"{len(plan)} ta fayl ko'chiriladi, {absent} ta diskda topilmadi")
+    if dry_run or not plan:
+        release_db(db)
+        return
+    
+    started = time.perf_counter()
+    done = 0
+    try:
+        for i in range(0, len(plan), batch):
+            chunk = plan[i:i + batch]
+            moved = []
+            for old, new in chunk:
+                names = [(old, new)] + [(thumb_filename(old, size), thumb_filename(new, size)) for size in THUMB_SIZES]
+                for src, dst in names:
+                    if src == old or source.exists(src):
+                        storage.save_file(source.path(src), dst, link=True)
+                        moved.append(src)
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("UPDATE materials SET filename=? WHERE filename=?",
+                           [(new, old) for old, new in chunk if new != old])
+            db.commit()
+            if storage.local or not keep_local:
+                for name in moved:
+                    source.delete(name)
+            done += len(chunk)
+            print(f"… {done}/{len(plan)} ({time.perf_counter() - started:.1f}s)")
+    finally:
+        release_db(db)
+    print(f"✅ {done} ta fayl ko'chirildi ({time.perf_counter() - started:.1f}s)")
+
+# ========================
+# SAHIFA KESHI (umumiy sahifalar uchun)
+# ========================
+# Sahifa tanasi bir marta render qilinadi va worker xotirasida saqlanadi. Shaxsiy qismlar
+# (nav, flash xabarlar, footer havolalari) keshda belgi sifatida turadi va har so'rovda
+# alohida kichik shablondan qo'yiladi - shuning uchun kirgan foydalanuvchilar ham
+# mehmonlar bilan bir xil keshdan foydalanadi.
+# Kesh page_versions jadvalidagi versiyalar bilan tekshiriladi (materials triggerlari
+# oshiradi), shuning uchun admin o'zgarishi barcha worker'larda darhol ko'rinadi.
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 512))  # 0 = o'chiq
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 30))  # soniya (view_count yangilanishi uchun)
+
+PERSONAL_FRAGMENTS = {
+    'nav': '_nav.html',
+    'flashes': '_flashes.html',
+    'footer': '_footer_links.html',
+}
+
+_page_cache = collections.OrderedDict()
+_page_cache_lock = threading.Lock()
+
+@app.template_global()
+def personal(name):
+    """Shaxsiy qism: kesh uchun render qilinayotganda - belgi, aks holda - tayyor HTML"""
+    if g.get('page_cache_render'):
+        return Markup(f"<!--personal:{name}-->")
+    return Markup(render_template(PERSONAL_FRAGMENTS[name]))
+
+def page_versions(db, tags):
+    """Teglarning joriy versiyalari"""
+    placeholders = ','.join('?' * len(tags))
+    rows = dict(db.execute(f"SELECT tag, version FROM page_versions WHERE tag IN ({placeholders})", tags).fetchall())
+    return tuple(rows.get(tag, 0) for tag in tags)
+
+def page_variant():
+    """Sahifa mazmuni faqat admin uchun farq qiladi (tahrirlash tugmalari).
+
+    Daraja sessiyadan emas, current_user() dan (USER_CACHE_TTL keshi) olinadi -
+    adminlikdan olingan foydalanuvchi qayta kirmasa ham admin variantini ko'rmaydi.
+    """
+    user = current_user()
+    level = (user['admin_level'] or 0) if user is not None else 0
+    if level == 2:
+        return 'main-admin'
+    if level == 1:
+        return f"admin:{user['id']}"
+    return None
+
+def cached_page(tags, render):
+    """render() natijasini teglar versiyasi va TTL bo'yicha keshlash, ETag/304 bilan"""
+    if not PAGE_CACHE_SIZE:
+        return render()
+    db = get_db()
+    versions = page_versions(db, tags)
+    db.close()
+    key = (request.endpoint, tuple(sorted(request.view_args.items())),
+           tuple(sorted(request.args.items(multi=True))), page_variant())
+    now = time.time()
+    with _page_cache_lock:
+        entry = _page_cache.get(key)
+        if entry and entry[0] == versions and entry[1] > now:
+            _page_cache.move_to_end(key)
+            status = 'hit'
+        else:
+            entry = None
+    
+    if entry is None:
+        g.page_cache_render = True
+        try:
+            rv = make_response(render())
+        finally:
+            g.page_cache_render = False
+        if rv.status_code != 200 or rv.mimetype != 'text/html':
+            return rv
+        body = rv.get_data(as_text=True)
+        entry = (versions, now + PAGE_CACHE_TTL, body, hashlib.md5(body.encode()).hexdigest()[:16])
+        with _page_cache_lock:
+            _page_cache[key] = entry
+            _page_cache.move_to_end(key)
+            while len(_page_cache) > PAGE_CACHE_SIZE:
+                _page_cache.popitem(last=False)
+        status = 'miss'
+    
+    body = entry[2]
+    parts = [render_template(template) for template in PERSONAL_FRAGMENTS.values()]
+    for name, part in zip(PERSONAL_FRAGMENTS, parts):
+        body = body.replace(f"<!--personal:{name}-->", part, 1)
+    etag = f"{entry[3]}-{zlib.crc32(''.join(parts).encode()):08x}"
+    
+    rv = make_response(body)
+    rv.set_etag(etag)
+    rv.headers['Cache-Control'] = 'private, no-cache'
+    rv.headers['X-Page-Cache'] = status
+    return rv.make_conditional(request)
+
 # ========================
 # UMUMIY SAHIFALAR
 # ========================
 @app.route("/")
 def index():
     """Bosh sahifa - statistika bilan"""
-    db = get_db()
-    stats = {
-        'books': db.execute("SELECT COUNT(*) as c FROM materials WHERE material_type='book'").fetchone()['c'],
-        'apps': db.execute("SELECT COUNT(*) as c FROM materials WHERE material_type='app'").fetchone()['c'],
-        'images': db.execute("SELECT COUNT(*) as c FROM materials WHERE material_type='image'").fetchone()['c'],
-        'videos': db.execute("SELECT COUNT(*) as c FROM materials WHERE material_type='video'").fetchone()['c'],
-    }
-    db.close()
-    return render_template("index.html", stats=stats)
+    def render():
+        db = get_db()
+        counts = dict(db.execute("SELECT material_type, count FROM material_counts").fetchall())
+        stats = {
+            'books': counts.get('book', 0),
+            'apps': counts.get('app', 0),
+            'images': counts.get('image', 0),
+            'videos': counts.get('video', 0),
+        }
+        db.close()
+        return render_template("index.html", stats=stats)
+    return cached_page(['counts'], render)
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -193,10 +1787,16 @@ def register():
             flash("❌ Парол бояд ҳадди аққал 6 аломат дароз бошад")
             return redirect(url_for('register'))
         
+        try:
+            pwhash = password_hasher.hash(password)
+        except HashingBusy:
+            flash("⏳ Сервер банд аст, лутфан пас аз чанд сония дубора кӯшиш кунед.")
+            return redirect(url_for('register'))
+        
         db = get_db()
         try:
             db.execute("INSERT INTO users (name, email, password, admin_level) VALUES (?,?,?,?)",
-                       (name, email, generate_password_hash(password), 0))
+                       (name, email, pwhash, 0))
             db.commit()
             flash("✅ Шумо бомуваффақият сабти ном шудед! Акнун шумо метавонед ворид шавед.")
             return redirect(url_for('login'))
@@ -216,10 +1816,24 @@ def login():
         password = request.form.get('password', '')
         
         db = get_db()
-        user = db.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
+        user = db.execute(HOT_QUERIES['login'], (email,)).fetchone()
         db.close()
         
-        if user and check_password_hash(user['password'], password):
+        try:
+            valid = bool(user) and password_hasher.verify(user['password'], password)
+            # Eski parametrlar bilan saqlangan xeshni jimgina yangilash
+            if valid and password_hasher.needs_rehash(user['password']):
+                db = get_db()
+                db.execute("UPDATE users SET password=? WHERE id=? AND password=?",
+                           (password_hasher.hash(password), user['id'], user['password']))
+                db.commit()
+                db.close()
+                invalidate_user(user['id'])
+        except HashingBusy:
+            flash("⏳ Сервер банд аст, лутфан пас аз чанд сония дубора кӯшиш кунед.")
+            return redirect(url_for('login'))
+        
+        if valid:
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['admin_level'] = user['admin_level']
@@ -251,70 +1865,617 @@ def logout():
 @app.route("/materials")
 @app.route("/materials/<material_type>")
 def materials(material_type=None):
-    """Barcha materiallar yoki turga qarab"""
+    """Barcha materiallar yoki turga qarab (kursorli sahifalash)"""
+    def render():
+        db = get_db()
+        limit = page_limit()
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+        
+        if material_type and material_type in ['book', 'app', 'image', 'video']:
+            rows, prev_after, next_before = keyset_page(
+                db, HOT_QUERIES['materials_by_type'], (material_type,),
+                before=before, after=after, limit=limit, key=KEYSET_QUERIES['materials_by_type']
+            )
+        else:
+            rows, prev_after, next_before = keyset_page(
+                db, HOT_QUERIES['materials_all'], (),
+                before=before, after=after, limit=limit, key=KEYSET_QUERIES['materials_all']
+            )
+        
+        db.close()
+        return render_template("materials.html", materials=rows, current_type=material_type,
+                               prev_after=prev_after, next_before=next_before)
+    return cached_page(['materials'], render)
+
+# ========================
+# QIDIRUV
+# ========================
+# bm25 og'irliklari: title, author, description
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+
+def fts_query(text):
+    """Foydalanuvchi matnini xavfsiz FTS5 so'roviga aylantirish (prefiks qidiruv)"""
+    terms = [t.replace('"', '""') for t in text.split()]
+    return ' '.join(f'"{t}"*' for t in terms if t)
+
+def search_materials(db, text, material_type=None, page=1, limit=PAGE_SIZE):
+    """FTS5 + bm25 bo'yicha qidirish; (rows, has_next) qaytaradi"""
+    query = fts_query(text)
+    if not query:
+        return [], False
+    sql = """
+        SELECT materials.*, bm25(materials_fts, ?, ?, ?) AS rank
+        FROM materials_fts
+        JOIN materials ON materials.id = materials_fts.rowid
+        WHERE materials_fts MATCH ?
+    """
+    params = list(SEARCH_WEIGHTS) + [query]
+    if material_type:
+        sql += " AND materials.material_type = ?"
+        params.append(material_type)
+    sql += " ORDER BY rank LIMIT ? OFFSET ?"
+    params += [limit + 1, (page - 1) * limit]
+    rows = db.execute(sql, params).fetchall()
+    return rows[:limit], len(rows) > limit
+
+def search_args():
+    """Qidiruv parametrlarini so'rovdan olish"""
+    text = request.args.get('q', '').strip()[:200]
+    material_type = request.args.get('type')
+    if material_type not in ALLOWED_EXTENSIONS:
+        material_type = None
+    page = max(1, request.args.get('page', 1, type=int))
+    return text, material_type, page
+
+@app.route("/search")
+def search():
+    """Materiallarni qidirish"""
+    text, material_type, page = search_args()
+    limit = page_limit()
     db = get_db()
+    rows, has_next = search_materials(db, text, material_type, page, limit)
+    db.close()
+    return render_template("search.html", materials=rows, q=text, current_type=material_type,
+                           page=page, has_next=has_next)
+
+@app.route("/material/<int:material_id>")
+def material_detail(material_id):
+    """Material tafsilotlari"""
+    def render():
+        db = get_db()
+        
+        # Material va yuklagan foydalanuvchi - bitta so'rovda
+        material = db.execute(HOT_QUERIES['material_detail'], (material_id,)).fetchone()
+        db.close()
+        
+        if not material:
+            abort(404)
+        
+        # Hali yozilmagan ko'rishlarni ham hisobga olish
+        material = dict(material)
+        material['view_count'] += view_buffer.pending(material_id)
+        uploader = {'name': material['uploader_name']} if material['uploader_name'] is not None else None
+        
+        return render_template("material_detail.html", material=material, uploader=uploader)
     
-    if material_type and material_type in ['book', 'app', 'image', 'video']:
-        rows = db.execute(
-            "SELECT * FROM materials WHERE material_type=? ORDER BY id DESC", 
-            (material_type,)
-        ).fetchall()
-    else:
-        rows = db.execute("SELECT * FROM materials ORDER BY id DESC").fetchall()
+    rv = cached_page([f"material:{material_id}"], render)
+    # Ko'rish keshdan berilganda ham hisoblanadi (mehmon uchun user_id = NULL)
+    view_buffer.add(material_id, session.get('user_id'))
+    return rv
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+def _read_span(path, start, length):
+    """Faylning [start, start+length) qismini bo'laklab o'qish"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def _byte_spans(ranges, size):
+    """Range sarlavhasidagi oraliqlarni [start, stop) ko'rinishiga keltirish"""
+    spans = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(0, size + start), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+    return spans
+
+def send_upload(filename, as_attachment=True, cache_control='no-cache'):
+    """Storage'dagi faylni Range, ETag/304 va proxy offload bilan yuborish"""
+    if not storage.local:
+        # S3: brauzer faylni bucket'dan oladi (Range/ETag'ni S3 bajaradi)
+        url = storage.url(filename, display_name(filename) if as_attachment else None, cache_control)
+        rv = redirect(url)
+        rv.headers['Cache-Control'] = 'no-store'
+        return rv
+    path = safe_join(storage.root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    size = st.st_size
+    etag = f"{st.st_mtime_ns:x}-{size:x}"
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    rv = app.response_class(mimetype=mimetype)
+    rv.set_etag(etag)
+    rv.last_modified = int(st.st_mtime)
+    rv.headers['Accept-Ranges'] = 'bytes'
+    rv.headers['Cache-Control'] = cache_control
+    if as_attachment:
+        rv.headers.set('Content-Disposition', 'attachment', filename=display_name(filename))
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=rv.last_modified):
+        rv.status_code = 304
+        return rv
+
+    # Faylni nginx/Apache yuboradi - Range'ni ham o'zi bajaradi
+    if DOWNLOAD_OFFLOAD == 'accel':
+        rv.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + url_quote(filename)
+        return rv
+    if DOWNLOAD_OFFLOAD == 'sendfile':
+        rv.headers['X-Sendfile'] = path
+        return rv
+
+    spans = None
+    if request.range and request.range.units == 'bytes':
+        if_range = request.if_range
+        if not (if_range.etag or if_range.date) or if_range.etag == etag or (
+                if_range.date and if_range.date.timestamp() >= int(st.st_mtime)):
+            spans = _byte_spans(request.range.ranges, size)
+            if not spans:
+                rv.status_code = 416
+                rv.headers['Content-Range'] = f"bytes */{size}"
+                return rv
+
+    if not spans:
+        # To'liq fayl: gunicorn wsgi.file_wrapper orqali sendfile() ishlatadi
+        rv.response = wrap_file(request.environ, open(path, 'rb'), DOWNLOAD_CHUNK_SIZE)
+        rv.direct_passthrough = True
+        rv.content_length = size
+        return rv
+
+    rv.status_code = 206
+    if len(spans) == 1:
+        start, stop = spans[0]
+        rv.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+        rv.content_length = stop - start
+        rv.response = _read_span(path, start, stop - start)
+        return rv
+
+    # Bir nechta oraliq - multipart/byteranges
+    boundary = os.urandom(12).hex()
+    parts = [((f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+               f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode(), start, stop)
+             for start, stop in spans]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    def generate():
+        for head, start, stop in parts:
+            yield head
+            yield from _read_span(path, start, stop - start)
+        yield closing
+
+    rv.headers['Content-Type'] = f"multipart/byteranges; boundary={boundary}"
+    rv.content_length = sum(len(head) + stop - start for head, start, stop in parts) + len(closing)
+    rv.response = generate()
+    return rv
+
+@app.route("/download/<path:filename>")
+def download_file(filename):
+    """Faylni yuklab olish"""
+    try:
+        return send_upload(filename)
+    except Exception as e:
+        flash(f"❌ Хатогии зеркашӣ кардани файл: {str(e)}")
+        return redirect(url_for('materials'))
+
+# ========================
+# THUMBNAIL'LAR (rasm materiallari uchun)
+# ========================
+# Kichik nusxalar asl fayl yonida saqlanadi: "<fayl>@small.webp", "<fayl>@medium.webp".
+# secure_filename '@' belgisini qoldirmaydi, shuning uchun yuklangan fayl nomi bilan to'qnashmaydi.
+THUMB_SIZES = {'small': 320, 'medium': 960}
+THUMB_FORMAT = 'WEBP' if Image is not None and features.check('webp') else 'JPEG'
+THUMB_EXT = 'webp' if THUMB_FORMAT == 'WEBP' else 'jpg'
+THUMB_SOURCE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'}
+THUMB_MAX_AGE = 365 * 24 * 3600
+
+def thumb_filename(filename, size):
+    """Asl fayl uchun thumbnail nomi"""
+    return f"{filename}@{size}.{THUMB_EXT}"
+
+def thumb_failed_name(filename):
+    """Thumbnail yasab bo'lmagan rasm belgisi - /thumb har safar qayta urinmaydi"""
+    return f"{filename}@failed"
+
+def mark_thumbnails_failed(filename):
+    try:
+        storage.save_fileobj(io.BytesIO(b''), thumb_failed_name(filename))
+    except Exception as e:
+        logging.warning(f"Could not mark thumbnail failure for {filename}: {e}")
+
+def has_thumbnails(filename):
+    """Bu fayldan thumbnail yasash mumkinmi"""
+    return (Image is not None and bool(filename) and '.' in filename
+            and filename.rsplit('.', 1)[1].lower() in THUMB_SOURCE_EXTENSIONS)
+
+def make_thumbnails(filename):
+    """Asl rasmdan barcha o'lchamdagi thumbnail'larni yaratish"""
+    if not has_thumbnails(filename):
+        return []
+    created = []
+    with storage.local_copy(filename) as source, Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        if THUMB_FORMAT == 'JPEG' and img.mode == 'RGBA':
+            img = img.convert('RGB')
+        for size, edge in THUMB_SIZES.items():
+            thumb = img.copy()
+            thumb.thumbnail((edge, edge))
+            name = thumb_filename(filename, size)
+            # Yarim yozilgan faylni hech kim ko'rmasligi uchun - vaqtinchalik fayl + joylash
+            tmp_path = storage.scratch_path(name)
+            thumb.save(tmp_path, THUMB_FORMAT, quality=80)
+            storage.save_file(tmp_path, name, move=True)
+            created.append(name)
+    return created
+
+def remove_thumbnails(filename):
+    """Fayl o'chirilganda yoki almashtirilganda thumbnail'larni o'chirish"""
+    if not filename:
+        return
+    for name in [thumb_filename(filename, size) for size in THUMB_SIZES] + [thumb_failed_name(filename)]:
+        try:
+            storage.delete(name)
+        except (OSError, ValueError):
+            pass
+
+@app.template_global()
+def thumb_url(material, size='small'):
+    """Thumbnail manzili; versiya fayl kalitidan olinadi (fayl almashsa kalit ham yangi)"""
+    version = zlib.crc32(material['filename'].encode()) if material['filename'] else 0
+    return url_for('thumbnail', material_id=material['id'], size=size, v=version)
+
+@app.cli.command("generate-thumbnails")
+def generate_thumbnails_command():
+    """Mavjud rasm materiallari uchun yetishmayotgan thumbnail'larni yaratish"""
+    init_db()
+    if Image is None:
+        raise SystemExit("❌ Pillow o'rnatilmagan")
+    db = get_db()
+    rows = db.execute("SELECT filename FROM materials WHERE material_type='image' AND filename IS NOT NULL").fetchall()
+    db.close()
+    done = 0
+    for row in rows:
+        try:
+            if make_thumbnails(row['filename']):
+                done += 1
+        except Exception as e:
+            print(f"⚠️ {row['filename']}: {e}")
+    print(f"✅ Thumbnail'lar yaratildi: {done} ta rasm")
+
+@app.route("/thumb/<int:material_id>/<size>")
+def thumbnail(material_id, size):
+    """Rasm materialining kichik nusxasi (uzoq muddat keshlanadi)"""
+    if size not in THUMB_SIZES:
+        abort(404)
+    db = get_db()
+    material = db.execute("SELECT filename, material_type FROM materials WHERE id=?", (material_id,)).fetchone()
+    db.close()
+    if not material or material['material_type'] != 'image' or not material['filename']:
+        abort(404)
+    filename = material['filename']
+    # Thumbnail yasab bo'lmaydigan formatlar (svg, ico) - asl faylning o'zi
+    if not has_thumbnails(filename):
+        return redirect(url_for('download_file', filename=filename))
+    
+    # ?v= versiyasi bor manzil hech qachon o'zgarmaydi
+    cache_control = f"public, max-age={THUMB_MAX_AGE}, immutable" if request.args.get('v') else "public, max-age=3600"
+    name = thumb_filename(filename, size)
+    if not storage.exists(name):
+        # Avval yasab bo'lmagan rasm - asl faylni qayta o'qimaymiz
+        failed = storage.exists(thumb_failed_name(filename))
+        if not failed:
+            # Fon vazifasi hali tugamagan yoki eski material - hozir yaratamiz
+            try:
+                make_thumbnails(filename)
+            except Exception as e:
+                logging.warning(f"Thumbnail failed for {filename}: {e}")
+                mark_thumbnails_failed(filename)
+                failed = True
+        if failed:
+            response = redirect(url_for('download_file', filename=filename))
+            response.headers['Cache-Control'] = cache_control
+            return response
     
+    return send_upload(name, as_attachment=False, cache_control=cache_control)
+
+# ========================
+# FON VAZIFALARI (data.db dagi navbat)
+# ========================
+# Og'ir ishlar (checksum, metama'lumot, thumbnail, fayl o'chirish, bildirishnoma tarqatish)
+# so'rov ichida emas, `flask --app app worker` jarayonlarida bajariladi.
+# Vazifa olinganda locked_until belgilanadi; worker o'lib qolsa, muddat o'tgach
+# vazifa boshqa worker'ga qaytadi (visibility timeout).
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))  # soniya
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', 300))  # soniya
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE = float(os.environ.get('JOB_RETRY_BASE', 10))  # 10, 20, 40, ... soniya
+JOB_RETRY_MAX = 3600
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))  # bajarilganlar saqlanadigan vaqt
+
+# Ustuvorliklar - kattasi oldin
+JOB_PRIORITY_HIGH = 10
+JOB_PRIORITY_NORMAL = 0
+JOB_PRIORITY_LOW = -10
+
+JOB_HANDLERS = {}
+
+def job_handler(kind, timeout=None):
+    """Vazifa turini ro'yxatga olish (timeout - shu tur uchun visibility timeout)"""
+    def decorator(f):
+        JOB_HANDLERS[kind] = (f, timeout or JOB_VISIBILITY_TIMEOUT)
+        return f
+    return decorator
+
+def enqueue_job(db, kind, payload=None, priority=JOB_PRIORITY_NORMAL, delay=0, max_attempts=None):
+    """Vazifani navbatga qo'shish.
+
+    Commit qilmaydi - vazifa chaqiruvchining tranzaksiyasi bilan birga saqlanadi,
+    shuning uchun material yozilmasa vazifa ham paydo bo'lmaydi.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    now = time.time()
+    cur = db.execute(
+        "INSERT INTO jobs (kind, payload, priority, max_attempts, run_at, created_at) VALUES (?,?,?,?,?,?)",
+        (kind, json.dumps(payload or {}), priority, max_attempts or JOB_MAX_ATTEMPTS, now + delay, now)
+    )
+    return cur.lastrowid
+
+def claim_job(db, worker_id):
+    """Navbatdagi eng muhim vazifani olish (yoki None)"""
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # Worker o'lib qolgan vazifalarni qaytarish
+        for job in db.execute(HOT_QUERIES['job_reclaim'], (now,)).fetchall():
+            if job['attempts'] >= job['max_attempts']:
+                db.execute("UPDATE jobs SET status='failed', locked_by=NULL, finished_at=?, "
+                           "last_error=COALESCE(last_error, 'visibility timeout') WHERE id=?", (now, job['id']))
+            else:
+                db.execute("UPDATE jobs SET status='queued', locked_by=NULL WHERE id=?", (job['id'],))
+        
+        job = db.execute(HOT_QUERIES['job_claim'], (now,)).fetchone()
+        if job:
+            timeout = JOB_HANDLERS.get(job['kind'], (None, JOB_VISIBILITY_TIMEOUT))[1]
+            db.execute(
+                "UPDATE jobs SET status='running', attempts=attempts+1, locked_by=?, locked_until=?, started_at=? WHERE id=?",
+                (worker_id, now + timeout, now, job['id'])
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return job
+
+def finish_job(db, job, worker_id, error=None):
+    """Vazifa natijasini yozish: bajarildi, qayta urinish yoki failed"""
+    now = time.time()
+    if error is None:
+        db.execute("UPDATE jobs SET status='done', locked_by=NULL, finished_at=? WHERE id=? AND locked_by=?",
+                   (now, job['id'], worker_id))
+    elif job['attempts'] + 1 >= job['max_attempts']:
+        db.execute("UPDATE jobs SET status='failed', locked_by=NULL, finished_at=?, last_error=? WHERE id=? AND locked_by=?",
+                   (now, error, job['id'], worker_id))
+    else:
+        delay = min(JOB_RETRY_BASE * 2 ** job['attempts'], JOB_RETRY_MAX)
+        db.execute("UPDATE jobs SET status='queued', locked_by=NULL, run_at=?, last_error=? WHERE id=? AND locked_by=?",
+                   (now + delay, error, job['id'], worker_id))
+    db.commit()
+
+def run_job(db, job, worker_id):
+    """Bitta vazifani bajarish va natijasini yozish"""
+    started = time.time()
+    handler = JOB_HANDLERS.get(job['kind'], (None, None))[0]
+    error = None
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        with app.app_context():
+            handler(**json.loads(job['payload']))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logging.warning(f"Job {job['id']} {job['kind']} failed (attempt {job['attempts'] + 1}): {error}")
+    finish_job(db, job, worker_id, error)
+    if error is None:
+        # Navbat kechikishi = boshlangan vaqt - rejalashtirilgan vaqt
+        logging.info(f"Job {job['id']} {job['kind']} done in {time.time() - started:.3f}s "
+                     f"(waited {started - job['run_at']:.3f}s)")
+    return error is None
+
+def purge_jobs(db):
+    """Eski bajarilgan/failed vazifalarni o'chirish"""
+    db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - JOB_RETENTION,))
+    db.commit()
+
+def run_worker(worker_id=None, burst=False, stop=None):
+    """Navbatni bo'shatuvchi sikl. burst=True - navbat bo'shaganda chiqadi"""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stop = stop or threading.Event()
+    db = acquire_db()
+    last_purge = 0
+    try:
+        while not stop.is_set():
+            if time.time() - last_purge > 3600:
+                purge_jobs(db)
+                if not burst:
+                    schedule_storage_gc(db)
+                last_purge = time.time()
+            job = claim_job(db, worker_id)
+            if job is None:
+                if burst:
+                    break
+                stop.wait(JOB_POLL_INTERVAL)
+                continue
+            run_job(db, job, worker_id)
+    finally:
+        release_db(db)
+
+def _worker_process(index):
+    """--processes bilan ishga tushirilgan alohida worker jarayoni"""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run_worker(f"{socket.gethostname()}:{os.getpid()}", stop=stop)
+
+def start_worker_thread():
+    """Development uchun: worker'ni web jarayoni ichida oqimda ishga tushirish"""
+    thread = threading.Thread(target=run_worker, name='jobs', daemon=True)
+    thread.start()
+    return thread
+
+@app.cli.command("worker")
+@click.option('--processes', default=1, show_default=True, help="Parallel worker jarayonlari soni")
+@click.option('--burst', is_flag=True, help="Navbat bo'shaganda chiqish")
+def worker_command(processes, burst):
+    """Fon vazifalari worker'i (Procfile: worker)"""
+    init_db()
+    if burst or processes <= 1:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        run_worker(burst=burst, stop=stop)
+        return
+    ctx = multiprocessing.get_context('spawn')
+    children = [ctx.Process(target=_worker_process, args=(i,), daemon=True) for i in range(processes)]
+    for child in children:
+        child.start()
+    signal.signal(signal.SIGTERM, lambda *_: [child.terminate() for child in children])
+    for child in children:
+        child.join()
+
+@app.cli.command("jobs")
+def jobs_command():
+    """Navbat holati va oxirgi soatdagi kechikish (p50/p95)"""
+    init_db()
+    db = get_db()
+    for row in db.execute("SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status ORDER BY kind, status"):
+        print(f"{row['kind']:<16} {row['status']:<8} {row['n']}")
+    waits = sorted(r[0] for r in db.execute(
+        "SELECT started_at - run_at FROM jobs WHERE status='done' AND finished_at > ?", (time.time() - 3600,)
+    ))
+    oldest = db.execute("SELECT MIN(run_at) FROM jobs WHERE status='queued' AND run_at <= ?", (time.time(),)).fetchone()[0]
     db.close()
-    return render_template("materials.html", materials=rows, current_type=material_type)
+    if waits:
+        p50 = waits[len(waits) // 2]
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+        print(f"queue wait (1h, {len(waits)} jobs): p50={p50 * 1000:.1f}ms p95={p95 * 1000:.1f}ms")
+    if oldest:
+        print(f"oldest ready job waiting: {time.time() - oldest:.1f}s")
+
+# --- Vazifa turlari ---
+@job_handler('thumbnails')
+def thumbnails_job(filename):
+    """Rasm uchun thumbnail'lar"""
+    try:
+        make_thumbnails(filename)
+    except Exception:
+        # Qayta urinish muvaffaqiyatli bo'lguncha /thumb asl faylga yo'naltiradi
+        mark_thumbnails_failed(filename)
+        raise
+
+@job_handler('file_metadata', timeout=1800)
+def file_metadata_job(material_id, filename):
+    """Fayl hajmi, sha256 va MIME turini hisoblash"""
+    st = storage.stat(filename)
+    if st is None:
+        return  # Fayl allaqachon almashtirilgan/o'chirilgan
+    digest = hashlib.sha256()
+    with contextlib.closing(storage.open(filename)) as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    db = get_db()
+    # Material boshqa faylga o'tgan bo'lsa - eskisini yozmaymiz
+    db.execute(
+        "UPDATE materials SET file_size=?, checksum=?, mime_type=? WHERE id=? AND filename=?",
+        (st[0], digest.hexdigest(), mimetypes.guess_type(filename)[0], material_id, filename)
+    )
+    db.commit()
+
+@job_handler('delete_file')
+def delete_file_job(filename):
+    """Almashtirilgan yoki o'chirilgan material faylini tozalash"""
+    db = get_db()
+    in_use = db.execute(HOT_QUERIES['file_in_use'], (filename,)).fetchone()
+    if in_use:
+        return  # Hali ishlatilmoqda - o'chirmaymiz
+    storage.delete(filename)
+    remove_thumbnails(filename)
+
+@job_handler('deliver_broadcast', timeout=900)
+def deliver_broadcast_job(broadcast_id):
+    """Ommaviy xabar uchun yetkazish qatorlarini bo'laklab yozish.
+
+    Har bir bo'lak alohida qisqa tranzaksiya (yozish qulfi uzoq ushlanmaydi);
+    INSERT OR IGNORE tufayli qayta urinish xavfsiz.
+    """
+    db = get_db()
+    broadcast = db.execute("SELECT segment FROM broadcasts WHERE id=?", (broadcast_id,)).fetchone()
+    if not broadcast:
+        return
+    condition = BROADCAST_SEGMENTS[broadcast['segment']][1]
+    last_id = 0
+    while True:
+        ids = [r[0] for r in db.execute(
+            f"SELECT id FROM users WHERE ({condition}) AND id > ? ORDER BY id LIMIT ?", (last_id, BROADCAST_BATCH)
+        )]
+        if not ids:
+            break
+        db.executemany("INSERT OR IGNORE INTO broadcast_deliveries (user_id, broadcast_id) VALUES (?,?)",
+                       [(user_id, broadcast_id) for user_id in ids])
+        db.commit()
+        last_id = ids[-1]
+    notification_hub.publish()
 
-@app.route("/material/<int:material_id>")
-def material_detail(material_id):
-    """Material tafsilotlari"""
+@job_handler('notify_users', timeout=900)
+def notify_users_job(title, message, user_ids=None):
+    """Yangilanishdan oldin navbatga qo'yilgan eski vazifa - broadcasts formatiga o'tkaziladi.
+
+    Matn bir marta yoziladi; user_ids=None - 'all' segmenti (deliver_broadcast yetkazadi),
+    aniq ro'yxat bo'lsa yetkazish qatorlari shu yerda, xabar bilan bitta tranzaksiyada.
+    """
     db = get_db()
-    
-    # Materialni olish
-    material = db.execute("SELECT * FROM materials WHERE id=?", (material_id,)).fetchone()
-    
-    if not material:
-        db.close()
-        abort(404)
-    
-    # Ko'rish sonini oshirish
-    db.execute("UPDATE materials SET view_count = view_count + 1 WHERE id=?", (material_id,))
-    
-    # Agar foydalanuvchi kirgan bo'lsa, tarixga qo'shish
-    if session.get('user_id'):
-        db.execute(
-            "INSERT INTO view_history (material_id, user_id, viewed_at) VALUES (?,?,?)",
-            (material_id, session['user_id'], datetime.datetime.utcnow().isoformat())
-        )
-    else:
-        # Mehmon foydalanuvchi uchun ham saqlaymiz (user_id = NULL)
-        db.execute(
-            "INSERT INTO view_history (material_id, user_id, viewed_at) VALUES (?,?,?)",
-            (material_id, None, datetime.datetime.utcnow().isoformat())
-        )
-    
+    sender = db.execute("SELECT id FROM users WHERE admin_level=2 ORDER BY id LIMIT 1").fetchone()
+    cur = db.execute(
+        "INSERT INTO broadcasts (segment, title, message, created_at, sent_by) VALUES (?,?,?,?,?)",
+        ('all' if user_ids is None else 'list', title, message, datetime.datetime.utcnow().isoformat(),
+         sender[0] if sender else 0)
+    )
+    if user_ids is None:
+        enqueue_job(db, 'deliver_broadcast', {'broadcast_id': cur.lastrowid}, priority=JOB_PRIORITY_HIGH)
+        db.commit()
+        return
+    for i in range(0, len(user_ids), BROADCAST_BATCH):
+        db.executemany("INSERT OR IGNORE INTO broadcast_deliveries (user_id, broadcast_id) VALUES (?,?)",
+                       [(user_id, cur.lastrowid) for user_id in user_ids[i:i + BROADCAST_BATCH]])
     db.commit()
-    
-    # Yuklagan foydalanuvchi ma'lumotini olish
-    uploader = None
-    if material['uploaded_by']:
-        uploader = db.execute(
-            "SELECT name FROM users WHERE id=?", 
-            (material['uploaded_by'],)
-        ).fetchone()
-    
-    db.close()
-    
-    return render_template("material_detail.html", material=material, uploader=uploader)
+    notification_hub.publish()
 
-@app.route("/download/<path:filename>")
-def download_file(filename):
-    """Faylni yuklab olish"""
-    try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
-    except Exception as e:
-        flash(f"❌ Хатогии зеркашӣ кардани файл: {str(e)}")
-        return redirect(url_for('materials'))
+def enqueue_file_jobs(db, material_id, filename, material_type):
+    """Yangi yuklangan fayl uchun vazifalar"""
+    if material_type == 'image' and has_thumbnails(filename):
+        enqueue_job(db, 'thumbnails', {'filename': filename}, priority=JOB_PRIORITY_HIGH)
+    enqueue_job(db, 'file_metadata', {'material_id': material_id, 'filename': filename})
 
 # ========================
 # ADMIN PANELI
@@ -328,10 +2489,7 @@ def admin():
     
     # Oddiy admin faqat o'z materiallarini ko'radi
     if user['admin_level'] == 1:
-        materials = db.execute(
-            "SELECT * FROM materials WHERE uploaded_by=? ORDER BY id DESC", 
-            (user['id'],)
-        ).fetchall()
+        materials = db.execute(HOT_QUERIES['admin_own_materials'], (user['id'],)).fetchall()
         users = []
     else:
         # Bosh admin hamma narsani ko'radi
@@ -367,27 +2525,21 @@ def admin_add_material():
     filename = None
     if uploaded_file and uploaded_file.filename:
         if allowed_file(uploaded_file.filename, material_type):
-            filename = secure_filename(uploaded_file.filename)
-            # Agar bir xil nomli fayl bo'lsa, yangi nom berish
-            base_name = filename
-            counter = 1
-            while os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                name, ext = os.path.splitext(base_name)
-                filename = f"{name}_{counter}{ext}"
-                counter += 1
-            
-            saved_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(saved_path)
+            # Kalitdagi token tufayli nomlar to'qnashmaydi
+            filename = new_storage_key(uploaded_file.filename)
+            storage.save_fileobj(uploaded_file.stream, filename)
         else:
             flash(f"❌ Навъи файл барои '{material_type}' мувофиқ нест")
             return redirect(url_for('admin'))
     
     # Ma'lumotlar bazasiga qo'shish
     db = get_db()
-    db.execute(
+    cur = db.execute(
         "INSERT INTO materials (title, author, description, filename, material_type, created_at, uploaded_by) VALUES (?,?,?,?,?,?,?)",
         (title, author, description, filename, material_type, datetime.datetime.utcnow().isoformat(), user['id'])
     )
+    if filename:
+        enqueue_file_jobs(db, cur.lastrowid, filename, material_type)
     db.commit()
     db.close()
     
@@ -426,31 +2578,18 @@ def admin_edit_material(material_id):
         # Yangi fayl yuklangan bo'lsa
         if uploaded_file and uploaded_file.filename:
             if allowed_file(uploaded_file.filename, material['material_type']):
-                # Eski faylni o'chirish
-                if material['filename']:
-                    old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], material['filename'])
-                    if os.path.exists(old_file_path):
-                        try:
-                            os.remove(old_file_path)
-                        except Exception:
-                            pass
-                
                 # Yangi faylni saqlash
-                filename = secure_filename(uploaded_file.filename)
-                base_name = filename
-                counter = 1
-                while os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                    name, ext = os.path.splitext(base_name)
-                    filename = f"{name}_{counter}{ext}"
-                    counter += 1
-                
-                saved_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                uploaded_file.save(saved_path)
+                filename = new_storage_key(uploaded_file.filename)
+                storage.save_fileobj(uploaded_file.stream, filename)
                 
                 db.execute(
                     "UPDATE materials SET title=?, author=?, description=?, filename=? WHERE id=?",
                     (title, author, description, filename, material_id)
                 )
+                enqueue_file_jobs(db, material_id, filename, material['material_type'])
+                # Eski fayl worker tomonidan o'chiriladi
+                if material['filename']:
+                    enqueue_job(db, 'delete_file', {'filename': material['filename']}, priority=JOB_PRIORITY_LOW)
             else:
                 flash("❌ Навъи мавод дуруст не")
                 db.close()
@@ -489,18 +2628,17 @@ def admin_delete_material(material_id):
         db.close()
         return redirect(url_for('admin'))
     
-    # Faylni o'chirish
-    if material['filename']:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], material['filename'])
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
+    # Buferdagi ko'rishlar o'chirilgandan keyin yozilmasligi uchun
+    view_buffer.flush()
     
-    # Bazadan o'chirish
+    # Bazadan o'chirish (fayl worker tomonidan o'chiriladi)
     db.execute("DELETE FROM materials WHERE id=?", (material_id,))
     db.execute("DELETE FROM view_history WHERE material_id=?", (material_id,))
+    db.execute("DELETE FROM view_rollup_hourly WHERE material_id=?", (material_id,))
+    db.execute("DELETE FROM view_rollup_daily WHERE material_id=?", (material_id,))
+    db.execute("DELETE FROM material_viewers WHERE material_id=?", (material_id,))
+    if material['filename']:
+        enqueue_job(db, 'delete_file', {'filename': material['filename']}, priority=JOB_PRIORITY_LOW)
     db.commit()
     db.close()
     
@@ -526,17 +2664,271 @@ def admin_material_stats(material_id):
         db.close()
         return redirect(url_for('admin'))
     
-    # Ko'rishlar tarixini olish
-    views = db.execute("""
-        SELECT view_history.*, users.name 
-        FROM view_history 
-        LEFT JOIN users ON view_history.user_id = users.id
-        WHERE material_id=? 
-        ORDER BY viewed_at DESC
-    """, (material_id,)).fetchall()
+    # Buferdagi ko'rishlarni yozib, yig'indilardan grafik va noyob tomoshabinlar
+    view_buffer.flush()
+    now = datetime.datetime.utcnow()
+    daily = time_series(
+        db.execute(
+            HOT_QUERIES['material_daily_views'],
+            (material_id, (now - datetime.timedelta(days=STATS_DAYS - 1)).strftime('%Y-%m-%d'))
+        ).fetchall(),
+        [(now - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(STATS_DAYS - 1, -1, -1)]
+    )
+    hourly = time_series(
+        db.execute(
+            HOT_QUERIES['material_hourly_views'],
+            (material_id, (now - datetime.timedelta(hours=STATS_HOURS - 1)).strftime('%Y-%m-%dT%H'))
+        ).fetchall(),
+        [(now - datetime.timedelta(hours=i)).strftime('%Y-%m-%dT%H') for i in range(STATS_HOURS - 1, -1, -1)]
+    )
+    viewers = db.execute(HOT_QUERIES['material_viewers'], (material_id,)).fetchone()[0]
+    
+    # Xom tarix - sahifalab
+    views, prev_after, next_before = keyset_page(
+        db, HOT_QUERIES['material_views'], (material_id,),
+        before=request.args.get('before', type=int), after=request.args.get('after', type=int),
+        limit=page_limit(), key=KEYSET_QUERIES['material_views']
+    )
+    
+    db.close()
+    return render_template("admin_material_stats.html", material=material, views=views,
+                           viewers=viewers, daily=daily, hourly=hourly,
+                           prev_after=prev_after, next_before=next_before)
+
+def time_series(rows, buckets):
+    """Yig'indilarni to'liq vaqt o'qiga joylash (bo'sh oraliqlar = 0)"""
+    counts = dict((row[0], row[1]) for row in rows)
+    series = [(bucket, counts.get(bucket, 0)) for bucket in buckets]
+    peak = max([views for _, views in series] + [1])
+    return {'points': series, 'peak': peak, 'total': sum(views for _, views in series)}
+
+# ========================
+# BO'LAKLAB YUKLASH (davom ettiriladigan)
+# ========================
+# 1. POST   /admin/uploads                 -> sessiya ochish (filename, size, material_type, material_id?)
+# 2. PUT    /admin/uploads/<id>            -> bo'lak qo'shish, "Upload-Offset" sarlavhasi bilan
+# 3. GET    /admin/uploads/<id>            -> qayerdan davom ettirish (offset)
+# 4. POST   /admin/uploads/<id>/commit     -> materialni yaratish yoki faylini almashtirish
+#    DELETE /admin/uploads/<id>            -> bekor qilish
+# Bo'laklar to'g'ridan-to'g'ri UPLOAD_FOLDER/.partial/<id>.part ga yoziladi va oxirida
+# rename() qilinadi - fayl hech qachon to'liq xotirada turmaydi va nusxalanmaydi.
+UPLOAD_PARTIAL_DIR = '.partial'
+
+def _upload_part_path(upload_id):
+    """Sessiya vaqtinchalik faylining yo'li"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], UPLOAD_PARTIAL_DIR, f"{upload_id}.part")
+
+def _upload_offset(upload_id):
+    """Qabul qilingan baytlar soni - fayl hajmi yagona haqiqat manbai"""
+    try:
+        return os.path.getsize(_upload_part_path(upload_id))
+    except OSError:
+        return 0
+
+def _get_upload_session(db, upload_id, user):
+    """Foydalanuvchiga tegishli sessiyani olish yoki 404"""
+    upload = db.execute(
+        "SELECT * FROM upload_sessions WHERE id=? AND user_id=?", (upload_id, user['id'])
+    ).fetchone()
+    if not upload:
+        abort(404)
+    return upload
+
+def _upload_error(message, status=400, **extra):
+    return jsonify({"error": message, **extra}), status
+
+def _upload_committed(db, upload):
+    """Allaqachon yakunlangan sessiya uchun commit javobi (javob yo'qolib, qayta yuborilganda)"""
+    material = db.execute("SELECT id, filename FROM materials WHERE id=?", (upload['committed_material_id'],)).fetchone()
+    db.close()
+    if not material:
+        return _upload_error("upload committed, material deleted", 404)
+    return jsonify({"material_id": material['id'], "filename": material['filename'], "redirect": url_for('admin')})
+
+def _expire_upload_sessions(db):
+    """Muddati o'tgan sessiyalarni va ularning fayllarini o'chirish"""
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=UPLOAD_SESSION_TTL)).isoformat()
+    expired = db.execute("SELECT id FROM upload_sessions WHERE created_at < ?", (cutoff,)).fetchall()
+    for row in expired:
+        try:
+            os.remove(_upload_part_path(row['id']))
+        except OSError:
+            pass
+    db.execute("DELETE FROM upload_sessions WHERE created_at < ?", (cutoff,))
+
+@app.route("/admin/uploads", methods=["POST"])
+@admin_required
+def admin_upload_create():
+    """Yuklash sessiyasini ochish"""
+    user = current_user()
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get('filename', ''))
+    material_type = data.get('material_type', 'book')
+    try:
+        size = int(data.get('size', -1))
+        material_id = int(data.get('material_id') or 0)
+    except (TypeError, ValueError):
+        return _upload_error("❌ Андозаи файл нодуруст аст")
+    
+    db = get_db()
+    if material_id:
+        material = db.execute("SELECT * FROM materials WHERE id=?", (material_id,)).fetchone()
+        if not material:
+            abort(404)
+        if user['admin_level'] == 1 and material['uploaded_by'] != user['id']:
+            return _upload_error("⚠️ Шумо фақат маводи ҳудатонро таҳрир карда метавонид", 403)
+        material_type = material['material_type']
+    elif user['admin_level'] == 1 and material_type not in ['book', 'app']:
+        return _upload_error("⚠️ Шумо метавонед танҳо китобҳо ва барномаҳоро зеркашӣ кунед", 403)
+    
+    if not filename or not allowed_file(filename, material_type):
+        return _upload_error(f"❌ Навъи файл барои '{material_type}' мувофиқ нест")
+    if size < 0 or size > MAX_UPLOAD_SIZE:
+        return _upload_error("❌ Андозаи файл нодуруст аст", 413 if size > 0 else 400)
+    
+    _expire_upload_sessions(db)
+    upload_id = os.urandom(16).hex()
+    db.execute(
+        "INSERT INTO upload_sessions (id, user_id, material_id, material_type, filename, size, created_at) VALUES (?,?,?,?,?,?,?)",
+        (upload_id, user['id'], material_id or None, material_type, filename, size, datetime.datetime.utcnow().isoformat())
+    )
+    db.commit()
+    db.close()
+    
+    os.makedirs(os.path.dirname(_upload_part_path(upload_id)), exist_ok=True)
+    open(_upload_part_path(upload_id), 'wb').close()
+    return jsonify({"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": UPLOAD_CHUNK_SIZE}), 201
+
+@app.route("/admin/uploads/<upload_id>", methods=["GET"])
+@admin_required
+def admin_upload_status(upload_id):
+    """Sessiya holati - qaysi baytdan davom ettirish kerak"""
+    db = get_db()
+    upload = _get_upload_session(db, upload_id, current_user())
+    db.close()
+    if upload['committed_material_id']:
+        return jsonify({"upload_id": upload_id, "offset": upload['size'], "size": upload['size'],
+                        "material_id": upload['committed_material_id']})
+    return jsonify({"upload_id": upload_id, "offset": _upload_offset(upload_id), "size": upload['size']})
+
+@app.route("/admin/uploads/<upload_id>", methods=["PUT", "PATCH"])
+@admin_required
+def admin_upload_chunk(upload_id):
+    """Bo'lakni fayl oxiriga qo'shish"""
+    db = get_db()
+    upload = _get_upload_session(db, upload_id, current_user())
+    db.close()
+    
+    client_offset = request.headers.get('Upload-Offset', type=int)
+    if client_offset is None:
+        return _upload_error("Upload-Offset header required")
+    if upload['committed_material_id']:
+        return _upload_error("upload already committed", 409, offset=upload['size'])
+    
+    with open(_upload_part_path(upload_id), 'ab') as f:
+        # Bir sessiyaga parallel bo'lak (masalan sekin so'rov tugamasdan qayta urinish) - kutmaymiz:
+        # bloklovchi flock gevent rejimida butun worker'ni to'xtatib qo'yadi
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return _upload_error("upload busy", 409, offset=f.seek(0, os.SEEK_END))
+        offset = f.seek(0, os.SEEK_END)
+        if client_offset != offset:
+            return _upload_error("offset mismatch", 409, offset=offset)
+        remaining = upload['size'] - offset
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            if len(chunk) > remaining:
+                f.truncate(offset)
+                return _upload_error("❌ Андозаи файл нодуруст аст", 413, offset=offset)
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.flush()
+        offset = f.tell()
+    
+    return jsonify({"upload_id": upload_id, "offset": offset, "size": upload['size']})
+
+@app.route("/admin/uploads/<upload_id>", methods=["DELETE"])
+@admin_required
+def admin_upload_abort(upload_id):
+    """Yuklashni bekor qilish"""
+    db = get_db()
+    _get_upload_session(db, upload_id, current_user())
+    db.execute("DELETE FROM upload_sessions WHERE id=?", (upload_id,))
+    db.commit()
+    db.close()
+    try:
+        os.remove(_upload_part_path(upload_id))
+    except OSError:
+        pass
+    return jsonify({"status": "ok"})
+
+@app.route("/admin/uploads/<upload_id>/commit", methods=["POST"])
+@admin_required
+def admin_upload_commit(upload_id):
+    """Yuklangan faylni joyiga ko'chirish va materialni yaratish/yangilash"""
+    user = current_user()
+    db = get_db()
+    upload = _get_upload_session(db, upload_id, user)
+    if upload['committed_material_id']:
+        return _upload_committed(db, upload)
+    
+    offset = _upload_offset(upload_id)
+    if offset != upload['size']:
+        db.close()
+        return _upload_error("upload incomplete", 409, offset=offset)
+    
+    title = request.form.get('title', '').strip()
+    author = request.form.get('author', '').strip()
+    description = request.form.get('description', '').strip()
+    if not title:
+        return _upload_error("❌ Унвон лозим аст")
+    
+    material = None
+    if upload['material_id']:
+        material = db.execute("SELECT * FROM materials WHERE id=?", (upload['material_id'],)).fetchone()
+        if not material:
+            abort(404)
+        if user['admin_level'] == 1 and material['uploaded_by'] != user['id']:
+            return _upload_error("⚠️ Шумо фақат маводи ҳудатонро таҳрир карда метавонид", 403)
+    
+    # Mahalliy storage'da bir fayl tizimi ichida rename - nusxalash yo'q
+    filename = new_storage_key(upload['filename'])
+    try:
+        storage.save_file(_upload_part_path(upload_id), filename, move=True)
+    except FileNotFoundError:
+        # Parallel commit faylni olib ketgan - u yakunlangan bo'lsa o'sha javob
+        upload = db.execute("SELECT * FROM upload_sessions WHERE id=?", (upload_id,)).fetchone()
+        if upload and upload['committed_material_id']:
+            return _upload_committed(db, upload)
+        db.close()
+        return _upload_error("upload data missing", 409, offset=0)
     
+    if material:
+        db.execute(
+            "UPDATE materials SET title=?, author=?, description=?, filename=? WHERE id=?",
+            (title, author, description, filename, material['id'])
+        )
+        material_id = material['id']
+    else:
+        cur = db.execute(
+            "INSERT INTO materials (title, author, description, filename, material_type, created_at, uploaded_by) VALUES (?,?,?,?,?,?,?)",
+            (title, author, description, filename, upload['material_type'], datetime.datetime.utcnow().isoformat(), user['id'])
+        )
+        material_id = cur.lastrowid
+    # Sessiya muddati tugaguncha saqlanadi: takroriy commit shu materialni qaytaradi
+    db.execute("UPDATE upload_sessions SET committed_material_id=? WHERE id=?", (material_id, upload_id))
+    enqueue_file_jobs(db, material_id, filename, upload['material_type'])
+    # Eski faylni o'chirish (tahrirlashda) - worker orqali
+    if material and material['filename']:
+        enqueue_job(db, 'delete_file', {'filename': material['filename']}, priority=JOB_PRIORITY_LOW)
+    db.commit()
     db.close()
-    return render_template("admin_material_stats.html", material=material, views=views)
+    
+    flash("✅ Мавод муваффақияти таҳрир шуд" if material else "✅ Мавод муваффақияти қӯш шуд")
+    return jsonify({"material_id": material_id, "filename": filename, "redirect": url_for('admin')})
 
 # ========================
 # FOYDALANUVCHILARNI BOSHQARISH (FAQAT BOSH ADMIN)
@@ -570,6 +2962,7 @@ def admin_toggle_user(user_id):
     db.execute("UPDATE users SET admin_level=? WHERE id=?", (new_level, user_id))
     db.commit()
     db.close()
+    invalidate_user(user_id)
     
     if new_level == 1:
         flash(f"✅ {target_user['name']} администратори оддӣ анҷом дода шуд")
@@ -603,6 +2996,7 @@ def admin_notify_user(user_id):
         )
         db.commit()
         db.close()
+        notification_hub.publish()
         
         flash(f"✅ {target_user['name']}ga xabar yuborildi")
         return redirect(url_for('admin'))
@@ -610,20 +3004,236 @@ def admin_notify_user(user_id):
     db.close()
     return render_template("admin_notify.html", user=target_user)
 
+@app.route("/admin/broadcast", methods=["GET", "POST"])
+@main_admin_required
+def admin_broadcast():
+    """Segmentga (hamma, adminlar, oddiy foydalanuvchilar) ommaviy xabar yuborish"""
+    if request.method == "POST":
+        segment = request.form.get('segment', '')
+        title = request.form.get('title', '').strip()
+        message = request.form.get('message', '').strip()
+        
+        if segment not in BROADCAST_SEGMENTS:
+            flash("❌ Гурӯҳи корбарон дуруст нест")
+            return redirect(url_for('admin_broadcast'))
+        if not title or not message:
+            flash("❌ Сарлавҳа ва паём лозим аст")
+            return redirect(url_for('admin_broadcast'))
+        
+        # Matn bir marta saqlanadi, yetkazish qatorlarini worker bo'laklab yozadi
+        db = get_db()
+        cur = db.execute(
+            "INSERT INTO broadcasts (segment, title, message, created_at, sent_by) VALUES (?,?,?,?,?)",
+            (segment, title, message, datetime.datetime.utcnow().isoformat(), session['user_id'])
+        )
+        enqueue_job(db, 'deliver_broadcast', {'broadcast_id': cur.lastrowid}, priority=JOB_PRIORITY_HIGH)
+        db.commit()
+        db.close()
+        
+        flash(f"✅ Ҳабар ба «{BROADCAST_SEGMENTS[segment][0]}» фиристода шуд")
+        return redirect(url_for('admin'))
+    
+    return render_template("admin_broadcast.html", segments=BROADCAST_SEGMENTS)
+
 # ========================
 # BILDIRISHNOMALAR
 # ========================
+# Yangi xabarlar SSE (/notifications/stream) orqali yuboriladi. Shu worker'dagi oqimlar
+# publish() bilan darhol uyg'onadi; boshqa worker/jarayonlardagi yozuvlar (masalan fon
+# vazifalari) NOTIFY_POLL_INTERVAL ichida indeksli so'rov bilan topiladi.
+# sync worker'da uzoq oqim worker'ni band qiladi, shuning uchun u yerda oqim bitta
+# javobdan keyin yopiladi va brauzer `retry` dan so'ng qayta ulanadi.
+NOTIFY_POLL_INTERVAL = float(os.environ.get('NOTIFY_POLL_INTERVAL', 2))  # soniya
+NOTIFY_STREAM_SECONDS = int(os.environ.get('NOTIFY_STREAM_SECONDS', 300 if SERVE_MODE == 'gevent' else 0))
+NOTIFY_RETRY_MS = int(os.environ.get('NOTIFY_RETRY_MS', 15000))
+NOTIFY_HEARTBEAT = 15  # soniya - proxy ulanishni yopib qo'ymasligi uchun
+NOTIFICATIONS_PAGE = 50
+MAX_ROWID = 2 ** 63 - 1
+
+# Ommaviy xabar segmentlari: nom -> (sarlavha, users jadvali uchun shart)
+BROADCAST_SEGMENTS = {
+    'all': ("Ҳамаи корбарон", "1"),
+    'admins': ("Ҳамаи администраторон", "admin_level >= 1"),
+    'users': ("Корбарони оддӣ", "COALESCE(admin_level, 0) = 0"),
+}
+BROADCAST_BATCH = int(os.environ.get('BROADCAST_BATCH', 1000))  # bitta tranzaksiyadagi yetkazishlar
+
+class NotificationHub:
+    """Worker ichidagi SSE oqimlarini yangi xabar haqida uyg'otish"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+    
+    @property
+    def version(self):
+        return self._version
+    
+    def publish(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+    
+    def wait(self, version, timeout):
+        """Yangi publish() yoki timeout'gacha kutish; joriy versiyani qaytaradi"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+notification_hub = NotificationHub()
+
+def sse_event(event, data, event_id=None):
+    """Bitta SSE xabarini formatlash"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, ensure_ascii=False)}"]
+    return "\n".join(lines) + "\n\n"
+
+def _notification_updates(user_id, last_direct, last_broadcast):
+    """Kursorlardan keyingi shaxsiy/ommaviy xabarlar va o'qilmaganlar soni.
+
+    Ulanish faqat so'rov vaqtida olinadi - oqim uni ushlab turmaydi.
+    """
+    db = acquire_db()
+    try:
+        direct = db.execute(HOT_QUERIES['notifications_since'], (user_id, last_direct)).fetchall()
+        broadcast = db.execute(HOT_QUERIES['broadcasts_since'], (user_id, last_broadcast)).fetchall()
+        unread = count_unread(db, user_id)
+    finally:
+        release_db(db)
+    return direct, broadcast, unread
+
+def _stream_cursor(value):
+    """Last-Event-ID ("<shaxsiy id>:<ommaviy id>") ni ajratish"""
+    try:
+        direct, _, broadcast = value.partition(':')
+        return int(direct), int(broadcast or 0)
+    except (AttributeError, ValueError):
+        return None
+
+@app.route("/notifications/stream")
+@login_required
+def notifications_stream():
+    """Yangi xabarlar va o'qilmaganlar soni (Server-Sent Events)"""
+    user_id = session['user_id']
+    # Qayta ulanishda brauzer oxirgi olingan id ni yuboradi
+    cursor = _stream_cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    
+    def stream(cursor):
+        deadline = time.monotonic() + NOTIFY_STREAM_SECONDS
+        version = notification_hub.version
+        last_unread = None
+        last_sent = time.monotonic()
+        yield f"retry: {NOTIFY_RETRY_MS}\n\n"
+        if cursor is None:
+            # Birinchi ulanish: eski xabarlarni emas, faqat keyingilarini yuborish
+            db = acquire_db()
+            cursor = db.execute(
+                "SELECT (SELECT COALESCE(MAX(id), 0) FROM notifications WHERE user_id=?),"
+                " (SELECT COALESCE(MAX(broadcast_id), 0) FROM broadcast_deliveries WHERE user_id=?)",
+                (user_id, user_id)
+            ).fetchone()
+            release_db(db)
+        last_direct, last_broadcast = cursor
+        while True:
+            direct, broadcast, unread = _notification_updates(user_id, last_direct, last_broadcast)
+            sent = False
+            for kind, rows in (('direct', direct), ('broadcast', broadcast)):
+                for row in rows:
+                    if kind == 'direct':
+                        last_direct = row['id']
+                    else:
+                        last_broadcast = row['id']
+                    yield sse_event('notification', dict(row, kind=kind), event_id=f"{last_direct}:{last_broadcast}")
+                    sent = True
+            if unread != last_unread:
+                last_unread = unread
+                yield sse_event('unread', {'count': unread}, event_id=f"{last_direct}:{last_broadcast}")
+                sent = True
+            if not sent and time.monotonic() - last_sent >= NOTIFY_HEARTBEAT:
+                yield ": ping\n\n"
+                sent = True
+            if sent:
+                last_sent = time.monotonic()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            version = notification_hub.wait(version, min(NOTIFY_POLL_INTERVAL, remaining))
+    
+    return Response(stream(cursor), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx buferlamasin
+    })
+
+def _read_response():
+    """Belgilashdan keyingi javob: fetch uchun JSON, oddiy forma uchun qaytish"""
+    g.pop('unread_count', None)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({"unread": unread_count()})
+    return redirect(request.referrer or url_for('notifications'))
+
+@app.route("/notifications/<int:note_id>/read", methods=["POST"])
+@login_required
+def notification_read(note_id):
+    """Bitta xabarni o'qilgan deb belgilash"""
+    db = get_db()
+    db.execute("UPDATE notifications SET is_read=1 WHERE id=? AND user_id=? AND is_read=0",
+               (note_id, session['user_id']))
+    db.commit()
+    db.close()
+    notification_hub.publish()
+    return _read_response()
+
+@app.route("/notifications/broadcast/<int:broadcast_id>/read", methods=["POST"])
+@login_required
+def broadcast_read(broadcast_id):
+    """Ommaviy xabarni o'qilgan deb belgilash"""
+    db = get_db()
+    db.execute("UPDATE broadcast_deliveries SET is_read=1 WHERE user_id=? AND broadcast_id=? AND is_read=0",
+               (session['user_id'], broadcast_id))
+    db.commit()
+    db.close()
+    notification_hub.publish()
+    return _read_response()
+
+@app.route("/notifications/read-all", methods=["POST"])
+@login_required
+def notifications_read_all():
+    """Barcha xabarlarni o'qilgan deb belgilash"""
+    db = get_db()
+    db.execute("UPDATE notifications SET is_read=1 WHERE user_id=? AND is_read=0", (session['user_id'],))
+    db.execute("UPDATE broadcast_deliveries SET is_read=1 WHERE user_id=? AND is_read=0", (session['user_id'],))
+    db.commit()
+    db.close()
+    notification_hub.publish()
+    return _read_response()
+
 @app.route("/notifications")
 @login_required
 def notifications():
-    """Foydalanuvchi bildirishnomalarini ko'rish"""
+    """Foydalanuvchi bildirishnomalarini ko'rish (shaxsiy + ommaviy, kursorli sahifalash)"""
+    user_id = session['user_id']
+    # Har bir manba o'z kursori bilan: ?before_n=<notifications.id>&before_b=<broadcasts.id>
+    before_n = request.args.get('before_n', type=int) or MAX_ROWID
+    before_b = request.args.get('before_b', type=int) or MAX_ROWID
     db = get_db()
-    notes = db.execute(
-        "SELECT * FROM notifications WHERE user_id=? ORDER BY id DESC", 
-        (session['user_id'],)
+    direct = db.execute(
+        HOT_QUERIES['notifications_direct'], (user_id, before_n, NOTIFICATIONS_PAGE + 1)
+    ).fetchall()
+    broadcast = db.execute(
+        HOT_QUERIES['notifications_broadcast'], (user_id, before_b, NOTIFICATIONS_PAGE + 1)
     ).fetchall()
     db.close()
-    return render_template("notifications.html", notes=notes)
+    
+    # Ikkala ro'yxat ham vaqt bo'yicha kamayib boradi - saralamasdan birlashtirish
+    merged = heapq.merge(direct, broadcast, key=lambda n: n['created_at'], reverse=True)
+    notes = [n for _, n in zip(range(NOTIFICATIONS_PAGE), merged)]
+    older = None
+    if next(merged, None) is not None:
+        older = {
+            'before_n': min([n['id'] for n in notes if n['kind'] == 'direct'], default=before_n),
+            'before_b': min([n['id'] for n in notes if n['kind'] == 'broadcast'], default=before_b),
+        }
+    return render_template("notifications.html", notes=notes, older=older)
 
 @app.route("/notify/reply", methods=["POST"])
 @login_required
@@ -643,6 +3253,7 @@ def notify_reply():
     )
     db.commit()
     db.close()
+    notification_hub.publish()
     
     flash("✅ Ҷавоб фиристода шуд")
     return redirect(url_for('notifications'))
@@ -655,6 +3266,148 @@ def tutorial_seen():
     """Tutorial ko'rilganini belgilash"""
     return jsonify({"status": "ok"})
 
+@app.route("/api/search")
+def api_search():
+    """Qidiruv - JSON variant"""
+    text, material_type, page = search_args()
+    limit = page_limit()
+    db = get_db()
+    rows, has_next = search_materials(db, text, material_type, page, limit)
+    db.close()
+    return jsonify({
+        "query": text,
+        "type": material_type,
+        "page": page,
+        "next_page": page + 1 if has_next else None,
+        "results": [{
+            "id": r['id'],
+            "title": r['title'],
+            "author": r['author'],
+            "description": r['description'],
+            "material_type": r['material_type'],
+            "view_count": r['view_count'],
+            "created_at": r['created_at'],
+            "url": url_for('material_detail', material_id=r['id']),
+        } for r in rows],
+    })
+
+# ========================
+# SOG'LIQ TEKSHIRUVI (liveness / readiness)
+# ========================
+# Probe'lar bazaga tegmaydi: har bir jarayondagi fon oqimi HEALTH_INTERVAL da o'lchovlarni
+# yangilaydi (o'qish kechikishi, WAL hajmi, navbat, bo'sh disk), endpoint'lar
+# esa tayyor snapshot'ni qaytaradi.
+HEALTH_INTERVAL = float(os.environ.get('HEALTH_INTERVAL', 5))  # soniya
+HEALTH_MAX_DB_MS = float(os.environ.get('HEALTH_MAX_DB_MS', 1000))
+HEALTH_MIN_FREE_MB = int(os.environ.get('HEALTH_MIN_FREE_MB', 512))
+
+class HealthMonitor:
+    """Bog'liqliklar holatining fonda yangilanadigan snapshot'i"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._pid = None
+
+    def snapshot(self):
+        """Oxirgi o'lchov (jarayondagi birinchi chaqiruv uni shu yerda bajaradi)"""
+        self._ensure_timer()
+        return self._snapshot
+
+    def check(self):
+        """Barcha o'lchovlarni bir marta bajarish"""
+        now = time.time()
+        snap = {'checked_at': now, 'pid': os.getpid(), 'problems': []}
+        conn = None
+        try:
+            conn = acquire_db()
+            started = time.perf_counter()
+            row = conn.execute(HOT_QUERIES['health_queue'], (now, now)).fetchone()
+            snap['db_read_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            snap['jobs_ready'], oldest, snap['jobs_running'] = row[0], row[1], row[2]
+            snap['jobs_oldest_wait_s'] = round(now - oldest, 1) if oldest else 0
+            # Faqat o'qish: yozish qulfini olish haqiqiy yozuvchilar (navbat, import,
+            # ko'rishlar buferi) bilan raqobatlashardi. WAL rejimida o'qish qulf kutmaydi.
+            if snap['db_read_ms'] > HEALTH_MAX_DB_MS:
+                snap['problems'].append('database slow')
+        except sqlite3.Error as e:
+            snap['db_error'] = str(e)
+            snap['problems'].append('database unavailable')
+        finally:
+            if conn is not None:
+                release_db(conn)
+        try:
+            snap['wal_bytes'] = os.path.getsize(f"{DB_PATH}-wal")
+        except OSError:
+            snap['wal_bytes'] = 0
+        try:
+            snap['upload_free_bytes'] = shutil.disk_usage(app.config['UPLOAD_FOLDER']).free
+            if snap['upload_free_bytes'] < HEALTH_MIN_FREE_MB * 1024 * 1024:
+                snap['problems'].append('upload volume almost full')
+        except OSError as e:
+            snap['upload_free_bytes'] = None
+            snap['problems'].append(f'upload folder unavailable: {e}')
+        return snap
+
+    def _ensure_timer(self):
+        """Har bir jarayonda birinchi o'lchov va fon oqimi"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._snapshot = self.check()
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="health-check", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._snapshot = self.check()
+            except Exception:
+                logging.exception("Health check failed")
+
+health_monitor = HealthMonitor(HEALTH_INTERVAL)
+
+@app.route("/health/live")
+def health_live():
+    """Liveness: jarayon so'rovlarga javob beryapti (bog'liqliklar tekshirilmaydi)"""
+    return jsonify({
+        "status": "alive",
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - health_monitor.started, 1),
+        "in_flight": metrics.value('http_requests_in_progress'),
+    })
+
+@app.route("/health")
+def health_check():
+    """Railway health check: faqat baza ochilishi (vaqtincha sekinlik yoki disk bosimi deploy'ni yiqitmaydi)"""
+    try:
+        db = get_db()
+        db.execute("SELECT 1").fetchone()
+        db.close()
+        return jsonify({"status": "healthy", "database": "connected"}), 200
+    except Exception as e:
+        logging.error(f"Health check failed: {e}")
+        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+
+@app.route("/health/ready")
+def health_ready():
+    """Readiness: oxirgi snapshot bo'yicha (sekin baza, disk, navbat)"""
+    snap = dict(health_monitor.snapshot())
+    snap['age_s'] = round(time.time() - snap.pop('checked_at'), 1)
+    problems = list(snap['problems'])
+    if snap['age_s'] > 3 * HEALTH_INTERVAL:
+        # Fon oqimi to'xtab qolgan yoki tekshiruv osilib qolgan
+        problems.append('health snapshot is stale')
+    snap['problems'] = problems
+    snap['status'] = 'unhealthy' if problems else 'healthy'
+    snap['database'] = 'error' if 'db_error' in snap else 'connected'
+    return jsonify(snap), 503 if problems else 200
+
 # ========================
 # BACKWARD COMPATIBILITY (Eski linklar uchun)
 # ========================
@@ -683,13 +3436,397 @@ def internal_error(e):
     flash("❌ Хатогии сервер рух дод")
     return redirect(url_for('index'))
 
+# ========================
+# OMMAVIY IMPORT (buyruq qatori)
+# ========================
+# Papka yoki CSV/JSON manifestdan minglab materiallarni yuklash. Fayllar sha256 bo'yicha
+# aniqlanadi: bazada bor checksum o'tkazib yuboriladi, storage kaliti checksum'dan olingani
+# uchun joylangan fayl qayta nusxalanmaydi - shuning uchun uzilgan importni shunchaki qayta
+# ishga tushirish kifoya.
+IMPORT_BATCH = 500
+
+def material_type_for(filename):
+    """Kengaytma bo'yicha material turini aniqlash (ALLOWED_EXTENSIONS dan)"""
+    if '.' not in filename:
+        return None
+    ext = filename.rsplit('.', 1)[1].lower()
+    for material_type, extensions in ALLOWED_EXTENSIONS.items():
+        if ext in extensions:
+            return material_type
+    return None
+
+def file_sha256(path):
+    """Faylning sha256 xeshi (1 MiB bo'laklarda)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def import_entries(source, manifest=None):
+    """Import qilinadigan yozuvlar: papkadan yoki manifestdan (path, title, author, description, material_type)"""
+    if manifest:
+        with open(manifest, encoding='utf-8') as f:
+            if manifest.lower().endswith('.json'):
+                rows = json.load(f)
+            else:
+                rows = list(csv.DictReader(f))
+        base = source or os.path.dirname(os.path.abspath(manifest))
+        for row in rows:
+            path = os.path.join(base, row['path'])
+            yield {
+                'path': path,
+                'title': (row.get('title') or '').strip() or None,
+                'author': (row.get('author') or '').strip(),
+                'description': (row.get('description') or '').strip(),
+                'material_type': row.get('material_type') or material_type_for(path),
+            }
+        return
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            yield {'path': os.path.join(root, name), 'title': None, 'author': '', 'description': '',
+                   'material_type': material_type_for(name)}
+
+class _Importer:
+    """Fayllarni parallel xeshlash va storage'ga joylash"""
+    
+    def __init__(self, link, known_checksums):
+        self.link = link
+        self.known = known_checksums
+        self.lock = threading.Lock()
+        self.link_failed = False
+    
+    def __call__(self, entry):
+        """Bitta faylni tayyorlash; (holat, entry) qaytaradi"""
+        path = entry['path']
+        # Manifestdagi tur ham veb-yuklash kabi kengaytma bilan tekshiriladi
+        if not allowed_file(path, entry['material_type']):
+            return 'unsupported', entry
+        if not os.path.isfile(path):
+            return 'missing', entry
+        size = os.path.getsize(path)
+        checksum = file_sha256(path)
+        with self.lock:
+            if checksum in self.known:
+                return 'duplicate', entry
+            self.known.add(checksum)
+        # Kalit mazmundan olinadi: uzilgan importni qayta ishga tushirganda joyida turgan
+        # fayl qayta nusxalanmaydi
+        filename = new_storage_key(os.path.basename(path), token=checksum)
+        if not storage.exists(filename):
+            how = storage.save_file(path, filename, link=self.link)
+            if self.link and how != 'linked':
+                self.link_failed = True  # Boshqa disk (EXDEV) yoki S3 - nusxalandi
+        title = entry['title'] or os.path.splitext(os.path.basename(path))[0].replace('_', ' ').strip()
+        return 'imported', dict(entry, title=title, filename=filename, size=size, checksum=checksum,
+                                mime_type=mimetypes.guess_type(filename)[0])
+
+def _insert_imported(db, rows, uploaded_by):
+    """Bir tranzaksiyada materiallar va ularning fon vazifalari"""
+    created_at = datetime.datetime.utcnow().isoformat()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.executemany(
+            "INSERT INTO materials (title, author, description, filename, material_type, created_at, uploaded_by,"
+            " file_size, checksum, mime_type) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            [(r['title'], r['author'], r['description'], r['filename'], r['material_type'], created_at, uploaded_by,
+              r['size'], r['checksum'], r['mime_type']) for r in rows]
+        )
+        # Checksum/metama'lumot allaqachon hisoblangan - faqat thumbnail'lar qoladi
+        for r in rows:
+            if r['material_type'] == 'image' and has_thumbnails(r['filename']):
+                enqueue_job(db, 'thumbnails', {'filename': r['filename']}, priority=JOB_PRIORITY_LOW)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+@app.cli.command("import-materials")
+@click.argument('source', required=False)
+@click.option('--manifest', help="CSV yoki JSON: path, title, author, description, material_type")
+@click.option('--link/--copy', default=False, show_default=True, help="Fayllarni hard-link qilish (bir diskda)")
+@click.option('--workers', default=os.cpu_count() or 4, show_default=True, help="Parallel xeshlash/nusxalash oqimlari")
+@click.option('--batch', default=IMPORT_BATCH, show_default=True, help="Bitta tranzaksiyadagi materiallar")
+@click.option('--uploader', default='admin@local', show_default=True, help="Materiallar egasi (email)")
+def import_materials_command(source, manifest, link, workers, batch, uploader):
+    """Papka yoki manifestdan materiallarni ommaviy import qilish (qayta ishga tushirish xavfsiz)"""
+    if not source and not manifest:
+        raise click.UsageError("SOURCE papkasi yoki --manifest kerak")
+    init_db()
+    db = acquire_db()
+    owner = db.execute("SELECT id FROM users WHERE email=?", (uploader,)).fetchone()
+    if not owner:
+        release_db(db)
+        raise SystemExit(f"❌ Foydalanuvchi topilmadi: {uploader}")
+    known = {r[0] for r in db.execute("SELECT checksum FROM materials WHERE checksum IS NOT NULL")}
+    
+    importer = _Importer(link, known)
+    counts = collections.Counter()
+    pending = []
+    started = time.perf_counter()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            # Xotirada cheklangan miqdordagi vazifalar - o'n minglab fayllar uchun
+            entries = import_entries(source, manifest)
+            window = set()
+            for entry in entries:
+                window.add(pool.submit(importer, entry))
+                if len(window) < workers * 4:
+                    continue
+                done, window = concurrent.futures.wait(window, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    status, row = future.result()
+                    counts[status] += 1
+                    if status == 'imported':
+                        pending.append(row)
+                if len(pending) >= batch:
+                    _insert_imported(db, pending, owner['id'])
+                    pending = []
+                    print(f"… {counts['imported']} imported, {counts['duplicate']} skipped "
+                          f"({time.perf_counter() - started:.1f}s)")
+            for future in concurrent.futures.as_completed(window):
+                status, row = future.result()
+                counts[status] += 1
+                if status == 'imported':
+                    pending.append(row)
+        if pending:
+            _insert_imported(db, pending, owner['id'])
+    finally:
+        release_db(db)
+    
+    elapsed = time.perf_counter() - started
+    print(f"✅ Import tugadi ({elapsed:.1f}s): {counts['imported']} ta yangi, {counts['duplicate']} ta mavjud, "
+          f"{counts['unsupported']} ta noma'lum yoki mos kelmaydigan tur, {counts['missing']} ta topilmadi")
+    if importer.link_failed:
+        print("ℹ️ Hard-link ishlamadi (boshqa disk?) - fayllar nusxalandi")
+
+# ========================
+# STORAGE TEKSHIRUVI (orphan va yo'qolgan fayllar)
+# ========================
+# Storage kalitlari va materials.filename bir xil (satr) tartibda o'qilib merge-join
+# qilinadi: xotirada faqat joriy kalitlar va bazadan bitta sahifa turadi. Rejalashtirilgan
+# tekshiruv STORAGE_GC_SLICE talik bo'laklarda ishlaydi - kursor vazifa payload'ida.
+STORAGE_GC_INTERVAL = int(os.environ.get('STORAGE_GC_INTERVAL', 24 * 3600))  # to'liq o'tishlar oralig'i, 0 = o'chiq
+STORAGE_GC_SLICE = int(os.environ.get('STORAGE_GC_SLICE', 5000))  # bitta vazifadagi fayllar
+STORAGE_GC_GRACE = int(os.environ.get('STORAGE_GC_GRACE', 3600))  # yangi fayllar yuklanayotgan bo'lishi mumkin
+STORAGE_GC_RECLAIM = os.environ.get('STORAGE_GC_RECLAIM', '0') == '1'  # rejalashtirilgan tekshiruv ham o'chiradi
+STORAGE_TEMP_MAX_AGE = 24 * 3600  # shundan eski *.tmp - to'xtab qolgan yozuv qoldig'i
+STORAGE_GC_DB_PAGE = 1000
+
+def _db_file_keys(db, after):
+    """materials.filename lar satr tartibida (keyset sahifalar - uzoq o'qish tranzaksiyasi yo'q)"""
+    while True:
+        keys = [r[0] for r in db.execute(HOT_QUERIES['storage_keys'], (after, STORAGE_GC_DB_PAGE))]
+        yield from keys
+        if len(keys) < STORAGE_GC_DB_PAGE:
+            return
+        after = keys[-1]
+
+def _thumbnail_source(key):
+    """'<kalit>@small.webp' (yoki '<kalit>@failed') -> '<kalit>', thumbnail bo'lmasa None"""
+    base, sep, suffix = key.rpartition('@')
+    if sep and (suffix == 'failed' or suffix.rpartition('.')[0] in THUMB_SIZES):
+        return base
+    return None
+
+def _file_in_use(db, key):
+    return db.execute(HOT_QUERIES['file_in_use'], (key,)).fetchone() is not None
+
+def scan_storage(db, after='', limit=None):
+    """Storage va bazani solishtirish (generator).
+
+    ('orphan', kalit, hajm) - bazada yo'q fayl, ('missing', kalit, None) - fayli yo'q qator.
+    Oxirgi element ('cursor', kalit, fayllar soni): keyingi bo'lak shu kalitdan keyin
+    boshlanadi; to'liq o'tish tugagan bo'lsa kalit ''.
+    """
+    now = time.time()
+    db_keys = _db_file_keys(db, after)
+    db_key = next(db_keys, None)
+    last, count = after, 0
+    for key, size, modified in storage.iter_keys(after):
+        if limit is not None and count >= limit:
+            yield 'cursor', last, count
+            return
+        count += 1
+        while db_key is not None and db_key < key:
+            yield 'missing', db_key, None
+            db_key = next(db_keys, None)
+        last = key
+        if db_key == key:
+            db_key = next(db_keys, None)
+            continue
+        age = now - modified
+        if key.endswith('.tmp'):
+            if age > STORAGE_TEMP_MAX_AGE:
+                yield 'orphan', key, size
+            continue
+        if age < STORAGE_GC_GRACE:
+            continue  # Fayl saqlangan, material hali yozilmagan bo'lishi mumkin
+        source = _thumbnail_source(key)
+        if source is not None and _file_in_use(db, source):
+            continue
+        yield 'orphan', key, size
+    while db_key is not None:
+        yield 'missing', db_key, None
+        db_key = next(db_keys, None)
+    yield 'cursor', '', count
+
+def reconcile_storage(db, after='', limit=None, reclaim=False, clear_missing=False, report=None):
+    """scan_storage natijalarini qayta tekshirib, ixtiyoriy tozalash; (statistika, kursor) qaytaradi"""
+    stats = collections.Counter()
+    for kind, key, value in scan_storage(db, after, limit):
+        if kind == 'cursor':
+            stats['files'] += value
+            return stats, key
+        if kind == 'orphan':
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += value
+            if report:
+                report(kind, key, value)
+            # Skanerdan keyin material yozilgan bo'lishi mumkin - o'chirishdan oldin yana tekshiramiz
+            source = _thumbnail_source(key)
+            if reclaim and not _file_in_use(db, key) and not (source and _file_in_use(db, source)):
+                storage.delete(key)
+                stats['reclaimed'] += 1
+                stats['reclaimed_bytes'] += value
+            continue
+        # Fayl keyinroq paydo bo'lgan yoki material o'chirilgan bo'lishi mumkin
+        if storage.exists(key) or not _file_in_use(db, key):
+            continue
+        stats['missing'] += 1
+        if report:
+            report(kind, key, None)
+        if clear_missing:
+            db.execute("UPDATE materials SET filename=NULL, file_size=NULL, checksum=NULL, mime_type=NULL "
+                       "WHERE filename=?", (key,))
+            db.commit()
+            stats['cleared'] += 1
+    return stats, ''
+
+def storage_gc_summary(stats):
+    mib = 1024 * 1024
+    return (f"{stats['files']} files, {stats['orphans']} orphans ({stats['orphan_bytes'] / mib:.1f} MiB), "
+            f"{stats['missing']} missing, {stats['reclaimed']} reclaimed ({stats['reclaimed_bytes'] / mib:.1f} MiB)")
+
+@job_handler('storage_gc', timeout=1800)
+def storage_gc_job(after='', totals=None):
+    """Rejalashtirilgan tekshiruvning bitta bo'lagi; keyingisini o'zi navbatga qo'yadi"""
+    db = get_db()
+    stats, cursor = reconcile_storage(db, after, STORAGE_GC_SLICE, reclaim=STORAGE_GC_RECLAIM)
+    totals = collections.Counter(totals) + stats if totals else stats
+    if cursor:
+        enqueue_job(db, 'storage_gc', {'after': cursor, 'totals': dict(totals)}, priority=JOB_PRIORITY_LOW)
+    else:
+        logging.info(f"Storage GC pass done: {storage_gc_summary(totals)}")
+        enqueue_job(db, 'storage_gc', priority=JOB_PRIORITY_LOW, delay=STORAGE_GC_INTERVAL)
+    db.commit()
+
+def schedule_storage_gc(db):
+    """Rejalashtirilgan tekshiruv zanjiri bo'lmasa boshlash (worker har soatda chaqiradi)"""
+    if not STORAGE_GC_INTERVAL:
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        pending = db.execute(
+            "SELECT 1 FROM jobs WHERE status IN ('queued', 'running') AND kind='storage_gc' LIMIT 1"
+        ).fetchone()
+        if not pending:
+            enqueue_job(db, 'storage_gc', priority=JOB_PRIORITY_LOW)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+@app.cli.command("storage-gc")
+@click.option('--reclaim', is_flag=True, help="Orphan fayllarni o'chirish")
+@click.option('--clear-missing', is_flag=True, help="Fayli yo'q materiallardan faylni olib tashlash")
+@click.option('--limit', type=int, help="Faqat shuncha faylni tekshirish (keyin --after bilan davom)")
+@click.option('--after', default='', help="Shu kalitdan keyingi fayllardan boshlash")
+@click.option('--quiet', '-q', is_flag=True, help="Har bir faylni chiqarmaslik, faqat xulosa")
+def storage_gc_command(reclaim, clear_missing, limit, after, quiet):
+    """Storage va materials.filename ni solishtirish: orphan va yo'qolgan fayllar"""
+    init_db()
+    db = acquire_db()
+    
+    def report(kind, key, size):
+        if quiet:
+            return
+        if kind == 'orphan':
+            print(f"orphan   {key} ({size} B)")
+        else:
+            ids = ', '.join(str(r[0]) for r in db.execute("SELECT id FROM materials WHERE filename=?", (key,)))
+            print(f"missing  {key} (material {ids})")
+    
+    started = time.perf_counter()
+    try:
+        stats, cursor = reconcile_storage(db, after, limit, reclaim, clear_missing, report)
+    finally:
+        release_db(db)
+    mib = 1024 * 1024
+    print(f"✅ {stats['files']} ta fayl tekshirildi ({time.perf_counter() - started:.1f}s): "
+          f"{stats['orphans']} ta orphan ({stats['orphan_bytes'] / mib:.1f} MiB), {stats['missing']} ta yo'qolgan fayl")
+    if reclaim:
+        print(f"🧹 {stats['reclaimed']} ta fayl o'chirildi, {stats['reclaimed_bytes']} bayt "
+              f"({stats['reclaimed_bytes'] / mib:.1f} MiB) bo'shatildi")
+    if clear_missing:
+        print(f"🧹 {stats['cleared']} ta material fayl havolasidan tozalandi")
+    if cursor:
+        print(f"… davom ettirish: --after '{cursor}'")
+
+# ========================
+# SHABLONLAR VA WORKER'NI ISITISH
+# ========================
+# Worker so'rov qabul qilishdan oldin chaqiriladigan sahifalar (ko'rishlar hisoblanmaydi)
+WARM_UP_PATHS = ['/', '/materials', '/search', '/login', '/register']
+
+def precompile_templates():
+    """Barcha shablonlarni kompilyatsiya qilish (bytecode keshga yoziladi)"""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+def warm_up():
+    """Shablonlarni yuklash va asosiy sahifalarni bir marta render qilish.
+
+    gunicorn.conf.py dagi post_worker_init shu funksiyani chaqiradi, shuning uchun
+    birinchi foydalanuvchi so'rovi kompilyatsiyani kutmaydi. (shablonlar soni, soniya) qaytaradi.
+    """
+    started = time.perf_counter()
+    count = len(precompile_templates())
+    health_monitor.snapshot()
+    client = app.test_client()
+    for path in WARM_UP_PATHS:
+        rv = client.get(path)
+        if rv.status_code != 200:
+            logging.warning(f"Warm-up {path}: HTTP {rv.status_code}")
+    return count, time.perf_counter() - started
+
+@app.cli.command("compile-templates")
+def compile_templates_command():
+    """Deploy bosqichi: shablonlarni TEMPLATE_CACHE_DIR ga oldindan kompilyatsiya qilish"""
+    if not TEMPLATE_CACHE_DIR:
+        raise SystemExit("❌ TEMPLATE_CACHE_DIR o'chirilgan")
+    started = time.perf_counter()
+    names = precompile_templates()
+    print(f"✅ {len(names)} ta shablon kompilyatsiya qilindi ({time.perf_counter() - started:.2f}s) -> {TEMPLATE_CACHE_DIR}")
+
 # ========================
 # DASTURNI ISHGA TUSHIRISH
 # ========================
+# Bazani yaratish yoki oxirgi versiyagacha yangilash (har bir worker'da)
+init_db()
+
 if __name__ == "__main__":
     
     # Ma'lumotlar bazasini yaratish
     init_db()
     
+    # Fon vazifalari (fayl tozalash, thumbnail'lar) shu jarayonda
+    start_worker_thread()
+    
     # Serverni ishga tushirish
     app.run(host="0.0.0.0", port=5050, debug=False)
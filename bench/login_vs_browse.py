@@ -0,0 +1,135 @@
+"""Login oqimi katalogni qanchalik sekinlashtirishini o'lchash.
+
+Gunicorn'ni har bir HASH_WORKERS qiymati bilan ishga tushiradi, bir vaqtda
+login va katalog (/materials) so'rovlarini yuboradi, login/s va katalog
+kechikishini (p50/p95/p99) chiqaradi.
+
+    python bench/login_vs_browse.py --workers 2 --hash-workers 0 1 --seconds 10
+"""
+import argparse
+import http.client
+import os
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from werkzeug.security import generate_password_hash
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/materials')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def seed(db_path, users):
+    db = sqlite3.connect(db_path)
+    pwhash = generate_password_hash('benchpass')
+    db.executemany(
+        "INSERT OR IGNORE INTO users (name, email, password, admin_level) VALUES (?,?,?,0)",
+        [(f"User {i}", f"user{i}@bench", pwhash) for i in range(users)]
+    )
+    db.executemany(
+        "INSERT INTO materials (title, author, description, material_type, created_at, uploaded_by) VALUES (?,?,?,?,?,1)",
+        [(f"Material {i}", "Bench", "Synthetic", "book", "2026-01-01T00:00:00") for i in range(200)]
+    )
+    db.commit()
+    db.close()
+
+
+def run_clients(port, login_threads, browse_threads, seconds):
+    stop = time.time() + seconds
+    logins, browse_latency, errors = [], [], []
+
+    def login_loop(i):
+        body = urllib.parse.urlencode({'email': f'user{i}@bench', 'password': 'benchpass'})
+        while time.time() < stop:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+                conn.getresponse().read()
+                logins.append(time.time())
+            except OSError as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+    def browse_loop():
+        while time.time() < stop:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            start = time.perf_counter()
+            try:
+                conn.request('GET', '/materials')
+                conn.getresponse().read()
+                browse_latency.append(time.perf_counter() - start)
+            except OSError as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+    threads = [threading.Thread(target=login_loop, args=(i,)) for i in range(login_threads)]
+    threads += [threading.Thread(target=browse_loop) for _ in range(browse_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(logins) / seconds, browse_latency, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker soni')
+    parser.add_argument('--threads', type=int, default=4, help='har bir worker oqimlari (gthread)')
+    parser.add_argument('--hash-workers', type=int, nargs='+', default=[0, 1])
+    parser.add_argument('--login-clients', type=int, default=8)
+    parser.add_argument('--browse-clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+
+    print(f"{'HASH_WORKERS':>12} {'login/s':>8} {'browse n':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for hash_workers in args.hash_workers:
+        tmp = tempfile.mkdtemp()
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, 'data.db'), UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                   HASH_WORKERS=str(hash_workers))
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+             '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning'],
+            cwd=APP_DIR, env=env,
+        )
+        try:
+            wait_for(args.port)
+            seed(env['DB_PATH'], args.login_clients)
+            rate, latency, errors = run_clients(args.port, args.login_clients, args.browse_clients, args.seconds)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait()
+        ms = [x * 1000 for x in latency]
+        print(f"{hash_workers:>12} {rate:>8.1f} {len(ms):>8} {statistics.median(ms) if ms else 0:>8.1f} "
+              f"{percentile(ms, 95):>8.1f} {percentile(ms, 99):>8.1f} {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Asosiy marshrutlar uchun yuklama testi (in-process va gunicorn).
+
+Sintetik data.db (foydalanuvchilar, materiallar, view_history) va fayllarni
+yaratadi, so'ng har bir ssenariyni bir necha oqimda belgilangan vaqt davomida
+chaqiradi. Natija: throughput (so'rov/s), p50/p95/p99 kechikish va xatolar soni.
+Natijalar JSON ga yoziladi - commitlar orasida solishtirish uchun --compare.
+
+    python bench/routes.py --materials 20000 --views 200000 --seconds 5
+    python bench/routes.py --mode gunicorn --workers 4 --out after.json --compare before.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ['index', 'materials', 'materials_page', 'material_detail', 'download', 'login', 'admin', 'admin_stats']
+PASSWORD = 'benchpass'
+ADMIN_EMAIL, ADMIN_PASSWORD = 'admin@local', 'admin123'
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# ---------- Sintetik ma'lumotlar ----------
+
+def seed(env, args):
+    """Bazani migratsiya qilish va sintetik ma'lumotlar bilan to'ldirish"""
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=APP_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    from werkzeug.security import generate_password_hash
+    rnd = random.Random(args.seed)
+    os.makedirs(env['UPLOAD_FOLDER'], exist_ok=True)
+
+    files = []
+    for i in range(args.files):
+        name = f"bench_{i}.pdf"
+        with open(os.path.join(env['UPLOAD_FOLDER'], name), 'wb') as f:
+            f.write(rnd.randbytes(args.file_size))
+        files.append(name)
+
+    db = sqlite3.connect(env['DB_PATH'])
+    pwhash = generate_password_hash(PASSWORD)
+    db.executemany(
+        "INSERT INTO users (name, email, password, admin_level) VALUES (?,?,?,0)",
+        [(f"User {i}", f"user{i}@bench", pwhash) for i in range(args.users)]
+    )
+    types = ['book', 'book', 'book', 'app', 'image', 'video']
+    db.executemany(
+        "INSERT INTO materials (title, author, description, filename, material_type, created_at, uploaded_by) "
+        "VALUES (?,?,?,?,?,?,1)",
+        [(f"Material {i}", f"Author {i % 500}", f"Synthetic description {i} " * 5,
+          files[i] if i < len(files) else None, rnd.choice(types), "2026-01-01T00:00:00")
+         for i in range(args.materials)]
+    )
+    start = datetime.datetime(2026, 1, 1)
+    user_ids = [r[0] for r in db.execute("SELECT id FROM users")]
+    for offset in range(0, args.views, 50000):
+        db.executemany(
+            "INSERT INTO view_history (material_id, user_id, viewed_at) VALUES (?,?,?)",
+            [(rnd.randint(1, args.materials), rnd.choice(user_ids + [None]),
+              (start + datetime.timedelta(seconds=rnd.randint(0, 60 * 86400))).strftime('%Y-%m-%d %H:%M:%S'))
+             for _ in range(min(50000, args.views - offset))]
+        )
+    db.commit()
+    db.close()
+    return files
+
+
+def scenario_request(name, rnd, args, files):
+    """(method, path, body) - ssenariy uchun tasodifiy so'rov"""
+    if name == 'index':
+        return 'GET', '/', None
+    if name == 'materials':
+        return 'GET', '/materials', None
+    if name == 'materials_page':
+        return 'GET', f"/materials?before={rnd.randint(1, args.materials)}", None
+    if name == 'material_detail':
+        return 'GET', f"/material/{rnd.randint(1, args.materials)}", None
+    if name == 'download':
+        return 'GET', f"/download/{rnd.choice(files)}", None
+    if name == 'login':
+        return 'POST', '/login', {'email': f"user{rnd.randrange(args.users)}@bench", 'password': PASSWORD}
+    if name == 'admin':
+        return 'GET', '/admin', None
+    if name == 'admin_stats':
+        return 'GET', f"/admin/material/{rnd.randint(1, min(args.materials, 1000))}/stats", None
+    raise ValueError(name)
+
+
+# ---------- Yuklama ----------
+
+def drive(make_client, scenario, args, files):
+    """Ssenariyni args.concurrency oqimda args.seconds davomida chaqirish"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    # Admin sessiyalari (login) o'lchovdan oldin ochiladi
+    clients = [make_client(admin=scenario.startswith('admin')) for _ in range(args.concurrency)]
+    stop = time.perf_counter() + args.seconds
+
+    def loop(i):
+        rnd = random.Random(args.seed + i)
+        send = clients[i]
+        local = []
+        local_errors = 0
+        while time.perf_counter() < stop:
+            method, path, body = scenario_request(scenario, rnd, args, files)
+            t = time.perf_counter()
+            try:
+                status = send(method, path, body)
+                ok = status < 400 and not (status == 302 and scenario.startswith('admin'))
+            except OSError:
+                ok = False
+            local.append(time.perf_counter() - t)
+            local_errors += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    ms = [x * 1000 for x in latencies]
+    return {
+        'requests': len(ms),
+        'rps': round(len(ms) / elapsed, 1),
+        'p50_ms': round(percentile(ms, 50), 2),
+        'p95_ms': round(percentile(ms, 95), 2),
+        'p99_ms': round(percentile(ms, 99), 2),
+        'errors': errors[0],
+    }
+
+
+def inprocess_clients():
+    """Flask test_client orqali (tarmoq va WSGI serversiz)"""
+    sys.path.insert(0, APP_DIR)
+    import app as app_module
+
+    def make_client(admin=False):
+        client = app_module.app.test_client()
+        if admin:
+            client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+
+        def send(method, path, body):
+            rv = client.open(path, method=method, data=body)
+            rv.get_data()
+            rv.close()
+            return rv.status_code
+        return send
+    return make_client
+
+
+def http_clients(port):
+    """Haqiqiy HTTP orqali (keep-alive ulanish har bir oqimda)"""
+    def make_client(admin=False):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        headers = {}
+        if admin:
+            body = urllib.parse.urlencode({'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+            conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            resp = conn.getresponse()
+            resp.read()
+            headers['Cookie'] = resp.getheader('Set-Cookie', '').split(';', 1)[0]
+
+        def send(method, path, body):
+            nonlocal conn
+            h = dict(headers)
+            if body is not None:
+                body = urllib.parse.urlencode(body)
+                h['Content-Type'] = 'application/x-www-form-urlencoded'
+            try:
+                conn.request(method, path, body, h)
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                raise OSError('connection reset')
+            if resp.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            return resp.status
+        return send
+    return make_client
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/static/css/style.css')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def print_table(mode, results, baseline=None):
+    print(f"\n[{mode}]")
+    print(f"{'scenario':<16} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>5}"
+          + (f" {'Δ req/s':>8} {'Δ p95':>8}" if baseline else ''))
+    for name, r in results.items():
+        line = (f"{name:<16} {r['requests']:>7} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                f"{r['p99_ms']:>8.2f} {r['errors']:>5}")
+        old = (baseline or {}).get(name)
+        if old:
+            rps = (r['rps'] / old['rps'] - 1) * 100 if old['rps'] else 0
+            p95 = (r['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0
+            line += f" {rps:>+7.0f}% {p95:>+7.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--materials', type=int, default=5000)
+    parser.add_argument('--views', type=int, default=50000, help='view_history qatorlari')
+    parser.add_argument('--files', type=int, default=100, help='sintetik fayllar soni')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='har bir fayl hajmi (bayt)')
+    parser.add_argument('--mode', nargs='+', choices=['inprocess', 'gunicorn'], default=['inprocess', 'gunicorn'])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--seconds', type=float, default=5, help='har bir ssenariy davomiyligi')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel mijozlar')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker soni')
+    parser.add_argument('--port', type=int, default=8795)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="JSON fayl (standart: bench/results/<commit>-<vaqt>.json)")
+    parser.add_argument('--compare', help='avvalgi JSON natija bilan solishtirish')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench-')
+    env = dict(os.environ, DB_PATH=os.path.join(tmp, 'data.db'), UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+               TEMPLATE_CACHE_DIR=os.path.join(tmp, 'jinja_cache'))
+    t = time.perf_counter()
+    files = seed(env, args)
+    print(f"seeded {args.users} users, {args.materials} materials, {args.views} views, "
+          f"{len(files)} files in {time.perf_counter() - t:.1f}s ({tmp})")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'results': {},
+    }
+    for mode in args.mode:
+        if mode == 'inprocess':
+            os.environ.update(env)
+            make_client = inprocess_clients()
+            results = {s: drive(make_client, s, args, files) for s in args.scenarios}
+        else:
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+                 '--workers', str(args.workers), '--log-level', 'warning'],
+                cwd=APP_DIR, env=env,
+            )
+            try:
+                wait_for(args.port)
+                results = {s: drive(http_clients(args.port), s, args, files) for s in args.scenarios}
+            finally:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait()
+        report['results'][mode] = results
+        print_table(mode, results, baseline.get(mode))
+
+    out = args.out or os.path.join(APP_DIR, 'bench', 'results', f"{report['commit']}-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Bitta gunicorn jarayonida ko'p sekin yuklab olishlarni sinash.
+
+N ta mijoz bir vaqtda /download/<fayl> ni ochadi va javobni sekin o'qiydi
+(mobil tarmoq kabi). Har bir worker turi uchun: nechta mijoz birinchi baytni
+olgani (ya'ni bir vaqtda xizmat qilingani), jami qabul qilingan hajm va shu
+paytda /materials kechikishi. Oxirida bo'laklab yuklash so'rovi tanasi to'xtab
+qolganda xuddi shu sessiyaga qayta urinish sinaladi (chunked-upload.js shunday
+qiladi): qayta urinish tez 409 "upload busy" olishi va worker boshqa so'rovlarga
+(/health/live) javob berishda davom etishi kerak.
+
+    python bench/slow_downloads.py --clients 300 --worker-class sync gevent
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/materials')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def slow_client(port, path, read_size, delay, results, deadline):
+    """Sarlavhalarni yuborib, javobni kichik bo'laklarda sekin o'qish"""
+    try:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=max(1, deadline - time.time()))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        received = 0
+        first_byte = None
+        while time.time() < deadline:
+            chunk = sock.recv(read_size)
+            if not chunk:
+                break
+            if first_byte is None:
+                first_byte = time.time()
+            received += len(chunk)
+            time.sleep(delay)
+        sock.close()
+        results.append((first_byte, received))
+    except OSError:
+        results.append((None, 0))
+
+
+def probe(port, deadline, latencies):
+    """Yuklashlar davomida katalog sahifasi kechikishi"""
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=max(0.1, deadline - time.time()))
+            conn.request('GET', '/materials')
+            conn.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+        except OSError:
+            latencies.append(float('inf'))
+        time.sleep(0.2)
+
+
+def login(port):
+    """Bosh admin sessiyasi cookie'si"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('POST', '/login', body='email=admin%40local&password=admin123',
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def stalled_upload_retry(port, timeout=5, size=1024 * 1024):
+    """Birinchi PUT tanasi to'xtab qolgan paytda o'sha sessiyaga qayta PUT: (status, ms)"""
+    cookie = login(port)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    conn.request('POST', '/admin/uploads', body=json.dumps({'filename': 'big.pdf', 'size': size, 'material_type': 'book'}),
+                 headers={'Content-Type': 'application/json', 'Cookie': cookie})
+    upload_id = json.loads(conn.getresponse().read())['upload_id']
+    conn.close()
+    # Sarlavhalar va tananing bir qismi - keyin mijoz "qotib qoladi"
+    stalled = socket.create_connection(('127.0.0.1', port))
+    stalled.sendall(f"PUT /admin/uploads/{upload_id} HTTP/1.1\r\nHost: bench\r\nCookie: {cookie}\r\n"
+                    f"Upload-Offset: 0\r\nContent-Length: {size}\r\n\r\n".encode() + b'x' * 4096)
+    time.sleep(0.5)
+    start = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        conn.request('PUT', f'/admin/uploads/{upload_id}', body=b'x' * size,
+                     headers={'Cookie': cookie, 'Upload-Offset': '0'})
+        resp = conn.getresponse()
+        resp.read()
+        status = resp.status
+    except OSError:
+        status = 'timeout'
+    elapsed = (time.perf_counter() - start) * 1000
+    stalled.close()
+    return status, elapsed
+
+
+def live_probe(port, stop, latencies):
+    """Qayta urinish paytida worker jonli ekanini tekshirish"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=3)
+            conn.request('GET', '/health/live')
+            conn.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+        except OSError:
+            latencies.append(float('inf'))
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--file-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--read-size', type=int, default=4096)
+    parser.add_argument('--delay', type=float, default=0.05, help="har bir o'qishdan keyin kutish (s)")
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--port', type=int, default=8798)
+    args = parser.parse_args()
+
+    print(f"{'worker':>8} {'clients':>8} {'served':>8} {'MiB recv':>9} {'catalog p50 ms':>15} {'catalog max ms':>15}"
+          f" {'upload retry':>13} {'retry ms':>9} {'live max ms':>12}")
+    for worker_class in args.worker_class:
+        tmp = tempfile.mkdtemp()
+        uploads = os.path.join(tmp, 'uploads')
+        os.makedirs(uploads)
+        with open(os.path.join(uploads, 'video.mp4'), 'wb') as f:
+            f.write(os.urandom(args.file_size))
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, 'data.db'), UPLOAD_FOLDER=uploads)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+             '--workers', '1', '--worker-class', worker_class, '--worker-connections', str(args.clients * 2),
+             '--timeout', str(int(args.seconds * 4)), '--log-level', 'warning'],
+            cwd=APP_DIR, env=env,
+        )
+        try:
+            wait_for(args.port)
+            deadline = time.time() + args.seconds
+            results, latencies = [], []
+            threads = [threading.Thread(target=slow_client, args=(
+                args.port, '/download/video.mp4', args.read_size, args.delay, results, deadline))
+                for _ in range(args.clients)]
+            threads.append(threading.Thread(target=probe, args=(args.port, deadline, latencies)))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            stop, live = threading.Event(), []
+            prober = threading.Thread(target=live_probe, args=(args.port, stop, live))
+            prober.start()
+            retry_status, retry_ms = stalled_upload_retry(args.port)
+            stop.set()
+            prober.join()
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait()
+        served = sum(1 for first, _ in results if first)
+        received = sum(n for _, n in results) / (1024 * 1024)
+        ms = sorted(x * 1000 for x in latencies) or [float('inf')]
+        print(f"{worker_class:>8} {args.clients:>8} {served:>8} {received:>9.1f} "
+              f"{ms[len(ms) // 2]:>15.1f} {ms[-1]:>15.1f} {retry_status!s:>13} {retry_ms:>9.1f} "
+              f"{max(live or [float('inf')]) * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+// O'qilmagan xabarlar nishoni va yangi xabarlar - SSE orqali, sahifani qayta yuklamasdan.
+// Nishon: <span data-unread-badge data-stream-url="..."> (faqat kirgan foydalanuvchilar uchun)
+(function () {
+  const badge = document.querySelector('[data-unread-badge]');
+  if (!badge || !window.EventSource) {
+    return;
+  }
+
+  function setUnread(count) {
+    badge.textContent = count;
+    badge.hidden = count === 0;
+  }
+
+  function addCard(note) {
+    const list = document.querySelector('[data-notifications-list]');
+    if (!list) {
+      return;
+    }
+    const card = document.createElement('div');
+    card.className = 'notification-card unread';
+    const icon = document.createElement('div');
+    icon.className = 'notification-icon';
+    icon.textContent = note.kind === 'broadcast' ? '📢' : '💌';
+    const content = document.createElement('div');
+    content.className = 'notification-content';
+    const title = document.createElement('h4');
+    title.className = 'notification-title';
+    title.textContent = note.title;
+    const message = document.createElement('div');
+    message.className = 'notification-message';
+    message.textContent = note.message;
+    content.append(title, message);
+    card.append(icon, content);
+    list.prepend(card);
+  }
+
+  const source = new EventSource(badge.dataset.streamUrl);
+  source.addEventListener('unread', function (e) {
+    setUnread(JSON.parse(e.data).count);
+  });
+  source.addEventListener('notification', function (e) {
+    addCard(JSON.parse(e.data));
+  });
+})();